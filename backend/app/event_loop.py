@@ -8,6 +8,7 @@ def configure_event_loop():
     """
     Configure the event loop based on the operating system.
     On Windows, this sets up the ProactorEventLoop to handle async I/O properly.
+    Elsewhere, uvloop is used when available.
     """
     if platform.system() == "Windows":
         try:
@@ -19,12 +20,17 @@ def configure_event_loop():
             raise
     else:
         try:
-            # For non-Windows systems, use the default event loop
-            asyncio.get_event_loop()
-            logger.info("Using default event loop")
-        except Exception as e:
-            logger.error(f"Failed to get default event loop: {e}")
-            raise
+            # For non-Windows systems, prefer the libuv-based uvloop when it is installed
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Configured uvloop event loop")
+        except ImportError:
+            try:
+                asyncio.get_event_loop()
+                logger.info("Using default event loop")
+            except Exception as e:
+                logger.error(f"Failed to get default event loop: {e}")
+                raise
 
 def get_event_loop():
     """
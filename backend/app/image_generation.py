@@ -1,19 +1,38 @@
+import asyncio
+import functools
 import logging
 import os
 import tempfile
+import secrets
+import threading
 import traceback
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import torch
-from compel import Compel
-from diffusers import (EulerAncestralDiscreteScheduler,
+from compel import Compel, ReturnedEmbeddingsType
+from diffusers import (DPMSolverMultistepScheduler,
+                       EulerAncestralDiscreteScheduler,
                        StableDiffusionPipeline, StableDiffusionXLPipeline)
+from diffusers.models.attention_processor import AttnProcessor2_0
 from huggingface_hub import HfFolder, hf_hub_download
 from PIL import Image
 from tqdm import tqdm
 
+try:
+    from diffusers import LCMScheduler
+except ImportError:
+    LCMScheduler = None
+
+try:
+    from torchao.quantization import (autoquant,
+                                      float8_dynamic_activation_float8_weight,
+                                      quantize_)
+except ImportError:
+    autoquant = None
+
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -21,24 +40,93 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+# Let cuDNN pick the fastest convolution algorithm for each input shape
+torch.backends.cudnn.benchmark = True
+
+# Requested sizes snap to multiples of this, bounding how many shapes the compiled UNet sees
+SIZE_BUCKET = 64
+
+# Default denoising steps per scheduler; the UNet runs once per step, so fewer steps is proportionally faster
+SCHEDULER_STEPS = {
+    "euler_a": 30,
+    "dpmpp_2m_karras": 20,
+    "dpmpp_2m_sde_karras": 20,
+    "lcm": 4
+}
+
+# Requests arriving within this window share one batched pipeline call
+IMAGE_MAX_BATCH_SIZE = 4
+# Offloading means the GPU is short on memory, so those batches stay small enough for 1024x1024
+OFFLOAD_MAX_BATCH_SIZE = 1
+IMAGE_BATCH_WAIT = 0.05  # seconds
+
+# Text-encoder outputs are cached for this many distinct prompts
+PROMPT_EMBED_CACHE_SIZE = 64
+
+# Image sizes compiled and autotuned at startup so first requests at these sizes are fast
+WARMUP_SIZES = ((512, 512), (768, 768), (1024, 1024))
+
+# Fast zlib level for saved PNGs; files are slightly larger but encode several times faster
+PNG_COMPRESS_LEVEL = 1
+
+# GPUs with less free memory than this keep idle pipeline components on the CPU
+LOW_VRAM_BYTES = 12 * 1024 ** 3
+
+# Quantize the UNet with torchao when it is installed (fp8 on SM 8.9+, int8 otherwise)
+QUANTIZE_UNET = os.environ.get("IMAGE_QUANTIZE_UNET", "1") == "1"
+
+# Drop SD 1.5's CLIP safety checker to save its load and per-image cost (opt-in; outputs are then unfiltered)
+DISABLE_SAFETY_CHECKER = os.environ.get("IMAGE_DISABLE_SAFETY_CHECKER", "0") == "1"
+
+# Loaded generators by (model_type, scheduler); they are never evicted since callers keep using them
+_generators: Dict[Tuple[str, str], "ImageGenerator"] = {}
+_generators_lock = threading.Lock()
+
 
 class ImageGenerator:
-    def __init__(self, model_type: str = "sd15"):
+    @classmethod
+    def get(cls, model_type: str = "sd15", scheduler: str = "dpmpp_2m_karras") -> "ImageGenerator":
+        """
+        Return a shared generator for the model type, loading and warming it on first use.
+        
+        Args:
+            model_type (str): Either "sdxl" for Stable Diffusion XL or "sd15" for Stable Diffusion 1.5
+            scheduler (str): One of the SCHEDULER_STEPS keys
+        """
+        key = (model_type, scheduler)
+        # Load under the lock so concurrent first calls share one pipeline
+        with _generators_lock:
+            generator = _generators.get(key)
+            if generator is None:
+                generator = _generators[key] = cls(model_type, scheduler)
+            return generator
+
+    def __init__(self, model_type: str = "sd15", scheduler: str = "dpmpp_2m_karras"):
         """
         Initialize the image generator with specified model type.
         
         Args:
             model_type (str): Either "sdxl" for Stable Diffusion XL or "sd15" for Stable Diffusion 1.5
+            scheduler (str): "dpmpp_2m_karras", "dpmpp_2m_sde_karras", "euler_a" or "lcm"
+                (LCM needs LCM-distilled weights)
         """
         try:
+            if scheduler not in SCHEDULER_STEPS:
+                raise ValueError(f"Unknown scheduler: {scheduler}")
+            self.scheduler_name = scheduler
+            self.default_steps = SCHEDULER_STEPS[scheduler]
+            
             # Set up device
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
             logger.info(f"Using device: {self.device}")
             self.model_type = model_type
+            self.dtype = self._pick_dtype()
+            logger.info(f"Using dtype: {self.dtype}")
             
             # Create output directory
             self.output_dir = Path("/images/generated_images")
             self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._output_prefix = f"{self.output_dir}{os.sep}"
             
             # Create models directory
             self.models_dir = Path("/images/models")
@@ -50,7 +138,8 @@ class ImageGenerator:
                 if model_type == "sdxl":
                     logger.info("Initializing Stable Diffusion XL pipeline...")
                     model_id = "stabilityai/stable-diffusion-xl-base-1.0"
-                    variant = "fp16" if self.device == "cuda" else None
+                    # bf16 weights are cast from the full-precision files rather than the fp16 variant
+                    variant = "fp16" if self.dtype == torch.float16 else None
                 else:
                     logger.info("Initializing Stable Diffusion 1.5 pipeline...")
                     model_id = "runwayml/stable-diffusion-v1-5"
@@ -61,55 +150,135 @@ class ImageGenerator:
                 if model_type == "sdxl":
                     self.pipeline = StableDiffusionXLPipeline.from_pretrained(
                         model_id,
-                        torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                        use_safetensors=False,  # Use PyTorch weights instead
+                        torch_dtype=self.dtype,
+                        low_cpu_mem_usage=True,
                         variant=variant,
                         cache_dir=str(self.models_dir),
                         local_files_only=False
                     )
                 else:
+                    # Nothing else filters prompts or images, so only drop the safety checker when asked to
+                    safety_kwargs = (
+                        {"safety_checker": None, "feature_extractor": None, "requires_safety_checker": False}
+                        if DISABLE_SAFETY_CHECKER else {}
+                    )
                     self.pipeline = StableDiffusionPipeline.from_pretrained(
                         model_id,
-                        torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                        use_safetensors=False,  # Use PyTorch weights instead
+                        torch_dtype=self.dtype,
+                        low_cpu_mem_usage=True,
                         variant=variant,
                         cache_dir=str(self.models_dir),
-                        local_files_only=False
+                        local_files_only=False,
+                        **safety_kwargs
                     )
+                # Inference only: keep dropout and similar layers in eval mode
+                for component in (self.pipeline.unet, self.pipeline.vae, self.pipeline.text_encoder,
+                                  getattr(self.pipeline, "text_encoder_2", None)):
+                    if component is not None:
+                        component.eval()
                 logger.info("Pipeline loaded successfully")
             except Exception as e:
                 logger.error(f"Failed to load pipeline: {str(e)}\n{traceback.format_exc()}")
                 raise
             
+            # On smaller GPUs stream each component (text encoder, UNet, VAE) onto the GPU only while it runs
+            self.offload = self.device == "cuda" and torch.cuda.mem_get_info()[0] < LOW_VRAM_BYTES
+            self.max_batch_size = OFFLOAD_MAX_BATCH_SIZE if self.offload else IMAGE_MAX_BATCH_SIZE
             try:
-                logger.info("Moving pipeline to device...")
-                self.pipeline = self.pipeline.to(self.device)
-                logger.info("Pipeline moved to device successfully")
+                if self.offload:
+                    logger.info("Enabling model CPU offload...")
+                    self.pipeline.enable_model_cpu_offload()
+                    logger.info("Model CPU offload enabled successfully")
+                else:
+                    logger.info("Moving pipeline to device...")
+                    self.pipeline = self.pipeline.to(self.device)
+                    logger.info("Pipeline moved to device successfully")
             except Exception as e:
                 logger.error(f"Failed to move pipeline to device: {str(e)}\n{traceback.format_exc()}")
                 raise
             
+            try:
+                # Tiles only kick in above the VAE's sample size, so small images decode unchanged
+                logger.info("Enabling VAE tiling and slicing...")
+                self.pipeline.vae.enable_tiling()
+                self.pipeline.vae.enable_slicing()
+                logger.info("VAE tiling and slicing enabled successfully")
+            except Exception as e:
+                logger.error(f"Failed to enable VAE tiling and slicing: {str(e)}\n{traceback.format_exc()}")
+                raise
+            
+            self.warmed_up = False
+            
+            # Eager and compiled UNets; the compiled one replays CUDA graphs captured per warmed shape
+            self._eager_unet = self.pipeline.unet
+            self._compiled_unet = None
+            self._graph_shapes = set()
+            # Compilation and CUDA graphs need the UNet resident on the GPU, so skip them when offloading
+            if self.device == "cuda" and not self.offload:
+                self._optimize_unet()
+            
             try:
                 logger.info("Initializing prompt weighting...")
-                self.compel = Compel(
-                    tokenizer=self.pipeline.tokenizer,
-                    text_encoder=self.pipeline.text_encoder
-                )
+                if model_type == "sdxl":
+                    # SDXL conditions on both text encoders and on the second one's pooled output
+                    self.compel = Compel(
+                        tokenizer=[self.pipeline.tokenizer, self.pipeline.tokenizer_2],
+                        text_encoder=[self.pipeline.text_encoder, self.pipeline.text_encoder_2],
+                        returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
+                        requires_pooled=[False, True]
+                    )
+                else:
+                    self.compel = Compel(
+                        tokenizer=self.pipeline.tokenizer,
+                        text_encoder=self.pipeline.text_encoder
+                    )
+                self._prompt_embeds: OrderedDict[str, Tuple[torch.Tensor, Optional[torch.Tensor]]] = OrderedDict()
                 logger.info("Prompt weighting initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize prompt weighting: {str(e)}\n{traceback.format_exc()}")
                 raise
             
             try:
-                logger.info("Setting up scheduler...")
-                self.pipeline.scheduler = EulerAncestralDiscreteScheduler.from_config(
-                    self.pipeline.scheduler.config
-                )
+                logger.info(f"Setting up {scheduler} scheduler...")
+                config = self.pipeline.scheduler.config
+                if scheduler == "dpmpp_2m_karras":
+                    self.pipeline.scheduler = DPMSolverMultistepScheduler.from_config(
+                        config, use_karras_sigmas=True, algorithm_type="dpmsolver++"
+                    )
+                elif scheduler == "dpmpp_2m_sde_karras":
+                    self.pipeline.scheduler = DPMSolverMultistepScheduler.from_config(
+                        config, use_karras_sigmas=True, algorithm_type="sde-dpmsolver++"
+                    )
+                elif scheduler == "lcm":
+                    if LCMScheduler is None:
+                        raise ImportError("LCMScheduler requires diffusers >= 0.22")
+                    self.pipeline.scheduler = LCMScheduler.from_config(config)
+                else:
+                    self.pipeline.scheduler = EulerAncestralDiscreteScheduler.from_config(config)
                 logger.info("Scheduler set up successfully")
             except Exception as e:
                 logger.error(f"Failed to set up scheduler: {str(e)}\n{traceback.format_exc()}")
                 raise
             
+            # One generator reused for unseeded requests, randomly seeded so their images differ
+            self._generator = torch.Generator(device=self.device)
+            self._generator.seed()
+            
+            # Pending requests, drained in batches by a single background task
+            self._request_queue: asyncio.Queue = asyncio.Queue()
+            self._batch_task: Optional[asyncio.Task] = None
+            
+            # Initial noise buffers reused across calls, one per (height, width) bucket sized for a full batch
+            self._latent_buffers: Dict[Tuple[int, int], torch.Tensor] = {}
+            
+            # Diffusion runs on a single worker thread so it never blocks the event loop
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-generation")
+            
+            # Compiled CUDA graphs belong to the thread that captured them, so warm up on the pipeline thread.
+            # Without a compiled UNet (CPU or offloading) there is nothing to capture, so skip the warmup
+            if self._compiled_unet is not None:
+                self._executor.submit(self._warmup).result()
+            
             logger.info("ImageGenerator initialized successfully")
             
         except Exception as e:
@@ -117,11 +286,234 @@ class ImageGenerator:
             logger.error(error_msg)
             raise Exception(error_msg)
 
+    def _pick_dtype(self) -> torch.dtype:
+        """Pick the weight dtype: bf16 for SDXL on SM 8.0+, fp16 on other GPUs and fp32 on CPU."""
+        if self.device != "cuda":
+            return torch.float32
+        # SDXL overflows in fp16 in places, which bf16's wider exponent range avoids
+        if self.model_type == "sdxl" and torch.cuda.get_device_capability() >= (8, 0):
+            return torch.bfloat16
+        return torch.float16
+
+    def _optimize_unet(self):
+        """Route attention through PyTorch SDPA, use channels-last convolutions and compile the UNet."""
+        try:
+            logger.info("Enabling scaled dot product attention...")
+            self.pipeline.unet.set_attn_processor(AttnProcessor2_0())
+            logger.info("Scaled dot product attention enabled successfully")
+        except Exception as e:
+            logger.error(f"Failed to enable scaled dot product attention: {str(e)}\n{traceback.format_exc()}")
+            raise
+        
+        try:
+            logger.info("Converting UNet and VAE to channels-last...")
+            self.pipeline.unet.to(memory_format=torch.channels_last)
+            self.pipeline.vae.to(memory_format=torch.channels_last)
+            logger.info("UNet and VAE converted successfully")
+        except Exception as e:
+            logger.error(f"Failed to convert UNet and VAE to channels-last: {str(e)}\n{traceback.format_exc()}")
+            raise
+        
+        # Concatenate q/k/v projections into one GEMM (available in diffusers >= 0.26)
+        if hasattr(self.pipeline, "fuse_qkv_projections"):
+            try:
+                logger.info("Fusing QKV projections...")
+                self.pipeline.fuse_qkv_projections()
+                logger.info("QKV projections fused successfully")
+            except Exception as e:
+                logger.warning(f"Failed to fuse QKV projections: {str(e)}")
+        
+        quantize = QUANTIZE_UNET and autoquant is not None
+        use_fp8 = quantize and torch.cuda.get_device_capability() >= (8, 9)
+        if use_fp8:
+            try:
+                logger.info("Quantizing UNet to fp8...")
+                quantize_(self.pipeline.unet, float8_dynamic_activation_float8_weight())
+                logger.info("UNet quantized successfully")
+            except Exception as e:
+                logger.warning(f"Failed to quantize UNet to fp8, falling back to int8: {str(e)}")
+                use_fp8 = False
+        
+        self._enable_compile_cache()
+        self._eager_unet = self.pipeline.unet
+        try:
+            # max-autotune also captures the UNet step as a CUDA graph and replays it each step
+            logger.info("Compiling UNet...")
+            self.pipeline.unet = torch.compile(
+                self.pipeline.unet, mode="max-autotune", fullgraph=True, dynamic=False
+            )
+            logger.info("UNet compiled successfully")
+        except Exception as e:
+            # Compilation is an optimization only, so keep the eager UNet if it fails
+            logger.warning(f"Failed to compile UNet, running eagerly: {str(e)}")
+        
+        if quantize and not use_fp8:
+            try:
+                # autoquant picks int8 kernels per layer once the warmup run feeds it real shapes
+                logger.info("Enabling dynamic int8 quantization of UNet...")
+                self.pipeline.unet = autoquant(self.pipeline.unet, error_on_unseen=False)
+                logger.info("UNet quantization enabled successfully")
+            except Exception as e:
+                logger.warning(f"Failed to quantize UNet, running unquantized: {str(e)}")
+        
+        if self.pipeline.unet is not self._eager_unet:
+            self._compiled_unet = self.pipeline.unet
+
+    def _enable_compile_cache(self):
+        """Persist compiled kernels and autotune results under the models directory across restarts."""
+        try:
+            import torch._inductor.config as inductor_config
+            
+            cache_dir = self.models_dir / "compile_cache"
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(cache_dir / "inductor"))
+            os.environ.setdefault("TRITON_CACHE_DIR", str(cache_dir / "triton"))
+            inductor_config.fx_graph_cache = True
+            logger.info(f"Compile cache enabled at {cache_dir}")
+        except Exception as e:
+            logger.warning(f"Failed to enable compile cache: {str(e)}")
+
+    def _warmup(self):
+        """Run one-step generations at each warmup size and batch size so compilation and autotuning happen before requests."""
+        try:
+            for width, height in WARMUP_SIZES:
+                # The batcher runs up to max_batch_size requests per call, each a distinct static shape
+                for batch_size in range(1, self.max_batch_size + 1):
+                    logger.info(f"Warming up pipeline at {width}x{height}, batch size {batch_size}...")
+                    with torch.inference_mode():
+                        self.pipeline(
+                            prompt=["warmup"] * batch_size,
+                            num_inference_steps=1,
+                            width=width,
+                            height=height
+                        )
+                    # Warmup runs at the default guidance scale, so only classifier-free guidance shapes are captured
+                    self._graph_shapes.add((width, height, batch_size, True))
+            self.warmed_up = True
+            logger.info("Pipeline warmed up successfully")
+        except Exception as e:
+            # torch.compile is lazy, so compilation errors (and out-of-memory at large shapes) surface here;
+            # fall back to the eager UNet rather than failing startup
+            logger.warning(f"Compiled UNet failed during warmup, running eagerly: {str(e)}")
+            self.pipeline.unet = self._eager_unet
+            self._compiled_unet = None
+            self._graph_shapes.clear()
+
+    @staticmethod
+    def _bucket_size(size: int) -> int:
+        """Snap an image dimension to the nearest size bucket."""
+        return max(SIZE_BUCKET, round(size / SIZE_BUCKET) * SIZE_BUCKET)
+
+    def _initial_latents(self, width: int, height: int, generators: List[torch.Generator]) -> torch.Tensor:
+        """Draw each request's initial noise from its generator into a preallocated buffer."""
+        latents = self._latent_buffers.get((height, width))
+        if latents is None:
+            scale = self.pipeline.vae_scale_factor
+            latents = torch.empty(
+                (self.max_batch_size, self.pipeline.unet.config.in_channels, height // scale, width // scale),
+                dtype=self.dtype,
+                device=self.device
+            )
+            self._latent_buffers[(height, width)] = latents
+        for i, generator in enumerate(generators):
+            torch.randn(latents[i:i + 1].shape, generator=generator, out=latents[i:i + 1])
+        return latents[:len(generators)]
+
+    def _encode_prompt(self, text: str) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Return (embeddings, pooled embeddings) for a prompt, reusing cached text-encoder output."""
+        cached = self._prompt_embeds.get(text)
+        if cached is not None:
+            self._prompt_embeds.move_to_end(text)
+            return cached
+        if self.model_type == "sdxl":
+            embeds, pooled = self.compel(text)
+        else:
+            embeds, pooled = self.compel(text), None
+        self._prompt_embeds[text] = (embeds, pooled)
+        if len(self._prompt_embeds) > PROMPT_EMBED_CACHE_SIZE:
+            self._prompt_embeds.popitem(last=False)
+        return embeds, pooled
+
+    @torch.inference_mode()
+    def _run_pipeline(self, requests: List[Dict[str, Any]]):
+        """Encode the prompts (cached) and run one batched pipeline call; called on the worker thread.
+
+        Inference mode is entered here rather than set globally because grad mode is thread-local.
+        """
+        first = requests[0]
+        width, height = first["width"], first["height"]
+        encoded = [self._encode_prompt(request["prompt"]) for request in requests]
+        negative = [self._encode_prompt(request["negative_prompt"] or "") for request in requests]
+        # Seeded requests get their own generator so batching does not change their output
+        generators = [
+            torch.Generator(device=self.device).manual_seed(request["seed"])
+            if request["seed"] is not None else self._generator
+            for request in requests
+        ]
+        kwargs = {}
+        if self.model_type == "sdxl":
+            kwargs["pooled_prompt_embeds"] = torch.cat([pooled for _, pooled in encoded])
+            kwargs["negative_pooled_prompt_embeds"] = torch.cat([pooled for _, pooled in negative])
+        self._select_unet(width, height, len(requests), first["guidance_scale"] > 1)
+        return self.pipeline(
+            prompt_embeds=torch.cat([embeds for embeds, _ in encoded]),
+            negative_prompt_embeds=torch.cat([embeds for embeds, _ in negative]),
+            num_inference_steps=first["num_inference_steps"],
+            guidance_scale=first["guidance_scale"],
+            width=width,
+            height=height,
+            latents=self._initial_latents(width, height, generators),
+            generator=generators,
+            **kwargs
+        ).images
+
+    def _select_unet(self, width: int, height: int, batch_size: int, guided: bool):
+        """Use the compiled UNet for warmed shapes and the eager one otherwise, avoiding a recompile.
+
+        Classifier-free guidance doubles the UNet batch, so it is part of the shape.
+        """
+        if (width, height, batch_size, guided) in self._graph_shapes:
+            self.pipeline.unet = self._compiled_unet
+        else:
+            self.pipeline.unet = self._eager_unet
+
+    async def _batch_loop(self):
+        """Gather requests that arrive together and run those with matching settings as one batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._request_queue.get()]
+            deadline = loop.time() + IMAGE_BATCH_WAIT
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._request_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            batches: Dict[Tuple, List[Dict[str, Any]]] = {}
+            for request in pending:
+                batches.setdefault(request["key"], []).append(request)
+            for requests in batches.values():
+                try:
+                    images = await loop.run_in_executor(self._executor, self._run_pipeline, requests)
+                    for request, image in zip(requests, images):
+                        # A caller may have gone away (cancelled) while its batch was running
+                        if not request["future"].done():
+                            request["future"].set_result(image)
+                except Exception as e:
+                    for request in requests:
+                        if not request["future"].done():
+                            request["future"].set_exception(e)
+                finally:
+                    for _ in requests:
+                        self._request_queue.task_done()
+
     async def generate_image(
         self,
         prompt: str,
         negative_prompt: Optional[str] = None,
-        num_inference_steps: int = 30,
+        num_inference_steps: Optional[int] = None,
         guidance_scale: float = 7.5,
         width: int = 512,
         height: int = 512,
@@ -133,7 +525,7 @@ class ImageGenerator:
         Args:
             prompt (str): The text prompt describing the image
             negative_prompt (Optional[str]): Negative prompt for better control
-            num_inference_steps (int): Number of denoising steps
+            num_inference_steps (Optional[int]): Number of denoising steps, defaulting to the scheduler's
             guidance_scale (float): How closely to follow the prompt
             width (int): Width of the generated image
             height (int): Height of the generated image
@@ -144,32 +536,43 @@ class ImageGenerator:
         """
         try:
             logger.info(f"Generating image with prompt: {prompt}")
-            # Generate the image
-            generator = torch.Generator(device=self.device)
-            if seed is not None:
-                generator.manual_seed(seed)
-            
-            # Generate the image
-            logger.info("Starting image generation...")
-            image = self.pipeline(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=num_inference_steps,
-                guidance_scale=guidance_scale,
-                width=width,
-                height=height,
-                generator=generator
-            ).images[0]
+            width, height = self._bucket_size(width), self._bucket_size(height)
+            num_inference_steps = num_inference_steps or self.default_steps
+            loop = asyncio.get_running_loop()
+            
+            # Queue the request for the batcher; requests with the same settings share a pipeline call
+            if self._batch_task is None or self._batch_task.done():
+                self._batch_task = asyncio.create_task(self._batch_loop())
+            future = loop.create_future()
+            await self._request_queue.put({
+                "key": (width, height, num_inference_steps, guidance_scale),
+                "prompt": prompt,
+                "negative_prompt": negative_prompt,
+                "num_inference_steps": num_inference_steps,
+                "guidance_scale": guidance_scale,
+                "width": width,
+                "height": height,
+                "seed": seed,
+                "future": future
+            })
+            logger.info("Waiting for image generation...")
+            image = await future
             
             # Save the image
-            image_id = str(uuid.uuid4())
-            image_path = self.output_dir / f"{image_id}.png"
+            image_id = secrets.token_hex(16)
+            image_path = f"{self._output_prefix}{image_id}.png"
             logger.info(f"Saving image to {image_path}")
-            image.save(image_path)
+            await loop.run_in_executor(
+                None,
+                functools.partial(image.save, image_path, compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+            )
             
             # Return the result
             return {
                 "image_url": f"/generated_images/{image_id}.png",
+                "num_inference_steps": num_inference_steps,
+                "width": width,
+                "height": height,
                 "generation_time": 0.0  # TODO: Implement actual timing
             }
             
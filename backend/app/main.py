@@ -1,28 +1,33 @@
 import asyncio
-import json
+import functools
+import hashlib
 import logging
 import os
-from collections import defaultdict
-from datetime import datetime, timedelta
-from json.decoder import JSONDecodeError
-from typing import Any, Dict, List, Optional, Union
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
-import aiohttp
+import aiofiles
+import orjson
 import uvicorn
-from event_loop import configure_event_loop, get_event_loop
-from fastapi import (Body, FastAPI, File, HTTPException, Query, UploadFile,
-                     WebSocket, WebSocketDisconnect)
+from cachetools import TTLCache
+from event_loop import configure_event_loop
+from fastapi import (Body, Depends, FastAPI, File, HTTPException, Query,
+                     UploadFile, WebSocket, WebSocketDisconnect)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.openapi.utils import get_openapi
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import (FileResponse, ORJSONResponse, RedirectResponse,
+                               Response, StreamingResponse)
+from starlette.requests import HTTPConnection, Request
 from image_generation import ImageGenerator
 from pydantic import BaseModel, Field
 from services.analytics import AnalyticsService
 from services.chatbot import Chatbot
-from services.llm_integration import LLMIntegration, ModelType
-from services.memory import MemoryManager
-from services.response import ResponseGenerator
-from services.swagger_config import SwaggerConfig
+from services.http_session import close_session
+from services.memory import MEMORY_PREVIEW_CHARS, MemoryManager
 
 # Configure logging
 logging.basicConfig(
@@ -39,7 +44,146 @@ STORAGE_FOLDER = 'storage'
 CHATS_FOLDER = 'storage/chats'
 UPLOADS_FOLDER = 'storage/uploads'
 LINKS_FOLDER = 'storage/links'
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'json', 'docx'}
+ALLOWED_EXTENSIONS = frozenset({'pdf', 'txt', 'json', 'docx'})
+ALLOWED_SUFFIXES = tuple(f'.{ext}' for ext in ALLOWED_EXTENSIONS)
+
+# Bytes read per chunk when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# When set (e.g. "/_link_files"), link content is handed to nginx via X-Accel-Redirect
+# to an internal location aliased to LINKS_FOLDER instead of being read by Python
+LINK_ACCEL_PREFIX = os.environ.get("LINK_ACCEL_PREFIX")
+
+# Batch link uploads crawl at most this many URLs at once, out of at most MAX_LINK_BATCH
+LINK_CRAWL_CONCURRENCY = 8
+MAX_LINK_BATCH = 50
+
+# Characters replaced with '_' when turning a URL into a link ID
+URL_SANITIZE_TABLE = str.maketrans({c: '_' for c in '/:?&=+@#%*|\\"\'<> '})
+
+# Browsers may reuse a listing or link content this long before revalidating with its ETag
+CACHE_CONTROL = "private, max-age=5"
+
+# Auto-reload watches the source tree for changes; turn it off (UVICORN_RELOAD=0) outside development
+UVICORN_RELOAD = os.environ.get("UVICORN_RELOAD", "1") == "1"
+# Per-request access log lines are off unless UVICORN_ACCESS_LOG=1
+UVICORN_ACCESS_LOG = os.environ.get("UVICORN_ACCESS_LOG", "0") == "1"
+
+# Longest chat message accepted, in characters
+MAX_MESSAGE_CHARS = 512
+
+# Chat response cache size and lifetime in seconds
+CHAT_CACHE_SIZE = 1024
+CHAT_CACHE_TTL = 3600
+
+# Paraphrased repeats within this cosine distance of a cached chat message reuse its response
+SEMANTIC_CACHE_MAX_DISTANCE = 0.08
+# Expired semantic cache entries are deleted this often, in seconds
+SEMANTIC_CACHE_PRUNE_INTERVAL = 600
+
+# Outgoing WebSocket messages are coalesced into one frame per flush window
+WS_QUEUE_SIZE = 256
+WS_FLUSH_INTERVAL = 0.02  # seconds
+
+# Serialize responses and WebSocket messages with orjson
+class JSONResponse(ORJSONResponse):
+    """orjson-rendered response that also accepts non-string dict keys (e.g. analytics hour buckets)."""
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+async def send_json(websocket: WebSocket, data: Any):
+    """Send a JSON text frame serialized with orjson."""
+    await websocket.send_text(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode())
+
+class WebSocketOutbox:
+    """Per-client send queue that batches messages queued within a flush window into one frame."""
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def send_json(self, data: Any):
+        """Queue a message for the next flush."""
+        # Drop the oldest message rather than block when a slow client falls behind
+        if self._queue.full():
+            self._queue.get_nowait()
+            logger.warning("WebSocket outbox full, dropping oldest message")
+        self._queue.put_nowait(data)
+
+    async def _flush_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(WS_FLUSH_INTERVAL)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await send_json(self.websocket, batch[0] if len(batch) == 1 else {"type": "batch", "events": batch})
+            except Exception as e:
+                logger.error(f"Error flushing WebSocket messages: {e}")
+                return
+
+    async def close(self):
+        """Stop the flush task."""
+        self._flush_task.cancel()
+        try:
+            await self._flush_task
+        except asyncio.CancelledError:
+            pass
+
+################################################## Services ##################################################
+# Services are created in the app lifespan and handed to routes as dependencies
+chat_cache: TTLCache = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+# Chat answers being generated, by request cache key, so identical concurrent requests share one
+chat_inflight: Dict[bytes, asyncio.Task] = {}
+# Text extraction running in the background for uploaded documents, by filename. Jobs are
+# removed once they succeed; failed ones stay so /document_status can report the error
+extraction_jobs: Dict[str, asyncio.Task] = {}
+
+async def get_analytics_service(connection: HTTPConnection) -> AnalyticsService:
+    return connection.app.state.analytics_service
+
+async def get_memory_manager(connection: HTTPConnection) -> MemoryManager:
+    return connection.app.state.memory_manager
+
+async def get_chatbot(connection: HTTPConnection) -> Chatbot:
+    return connection.app.state.chatbot
+
+async def get_semantic_cache(connection: HTTPConnection) -> Any:
+    return connection.app.state.semantic_cache
+
+def get_image_generator() -> ImageGenerator:
+    """Return the shared image generator, loading the pipeline on first use."""
+    return ImageGenerator.get()
+
+async def preload_image_generator():
+    """Load and warm the image pipeline before serving requests."""
+    try:
+        await asyncio.to_thread(get_image_generator)
+    except Exception as e:
+        logger.error(f"Error preloading image generator: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the services and load persisted data on startup, then flush and close them on shutdown."""
+    app.state.chatbot = Chatbot("http://localhost:11434/api/generate", STORAGE_FOLDER, CHATS_FOLDER, UPLOADS_FOLDER, LINKS_FOLDER)
+    # Routes share the chatbot's own services rather than starting a second set
+    app.state.analytics_service = app.state.chatbot.analytics_service
+    app.state.memory_manager = app.state.chatbot.memory_manager
+    app.state.semantic_cache = app.state.chatbot.memory_manager.client.get_or_create_collection(
+        name="chat_cache",
+        metadata={"hnsw:space": "cosine"}
+    )
+    await load_persisted_data(app.state.chatbot)
+    await preload_image_generator()
+    await app.state.analytics_service.start()
+    semantic_cache_pruner = asyncio.create_task(prune_semantic_cache(app.state.semantic_cache))
+    yield
+    semantic_cache_pruner.cancel()
+    for job in extraction_jobs.values():
+        job.cancel()
+    await app.state.analytics_service.stop()
+    await app.state.chatbot.close()
+    await close_session()
 
 # Initialize FastAPI app with proper documentation settings
 app = FastAPI(
@@ -48,7 +192,9 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=JSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -60,62 +206,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-################################################## Services ##################################################
-# Initialize services
-analytics_service = AnalyticsService()
-memory_manager = MemoryManager()
-llm_integration = LLMIntegration()
-response_generator = ResponseGenerator(llm_integration)
-chatbot = Chatbot("http://localhost:11434/api/generate", STORAGE_FOLDER, CHATS_FOLDER, UPLOADS_FOLDER, LINKS_FOLDER)
-
 ################################################## Load Persisted Data ##################################################
 # Load persisted data
-def load_persisted_data():
-    """Load persisted documents and links from disk."""
+async def _load_document(chatbot: Chatbot, filename: str):
+    """Load one document's sidecar metadata and content."""
+    async with aiofiles.open(os.path.join(UPLOADS_FOLDER, f"{filename}.meta.json"), 'rb') as f:
+        metadata = orjson.loads(await f.read())
+    content = metadata.pop('content', '')
+    if filename not in chatbot.documents:
+        chatbot.documents[filename] = content
+    chatbot.document_meta[filename] = metadata
+    chatbot.list_document(filename, publish=False)
+
+async def _load_link(chatbot: Chatbot, link_dir: str):
+    """Load one link's metadata, and its content if the content store doesn't hold it yet."""
+    link_path = os.path.join(LINKS_FOLDER, link_dir)
+    metadata_path = os.path.join(link_path, 'meta.json')
+    content_path = os.path.join(link_path, 'content.txt')
     try:
-        # Load documents
-        for filename in os.listdir(UPLOADS_FOLDER):
-            if filename.endswith('.meta.json'):
-                continue
-            filepath = os.path.join(UPLOADS_FOLDER, filename)
-            metadata_path = os.path.join(UPLOADS_FOLDER, f"{filename}.meta.json")
-            
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                    chatbot.documents[filename] = metadata.get('content', '')
+        async with aiofiles.open(metadata_path, 'rb') as f:
+            metadata = orjson.loads(await f.read())
+        chatbot.list_link(link_dir, metadata, publish=False)
+        # The content store persists across restarts, so only links missing from it are read in full
+        if link_dir in chatbot.links:
+            return
+        async with aiofiles.open(content_path, 'r', encoding='utf-8') as f:
+            content = await f.read()
+    except FileNotFoundError:
+        return
         
-        # Load links
-        for link_dir in os.listdir(LINKS_FOLDER):
-            link_path = os.path.join(LINKS_FOLDER, link_dir)
-            if not os.path.isdir(link_path):
-                continue
-                
-            metadata_path = os.path.join(link_path, 'meta.json')
-            content_path = os.path.join(link_path, 'content.txt')
-            
-            if os.path.exists(metadata_path) and os.path.exists(content_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                with open(content_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                chatbot.links[link_dir] = {
-                    'url': metadata.get('url'),
-                    'title': metadata.get('title'),
-                    'description': metadata.get('description'),
-                    'image': metadata.get('image'),
-                    'content': content,
-                    'timestamp': metadata.get('timestamp')
-                }
+    chatbot.links[link_dir] = {
+        'url': metadata.get('url'),
+        'title': metadata.get('title'),
+        'description': metadata.get('description'),
+        'image': metadata.get('image'),
+        'content': content,
+        'timestamp': metadata.get('timestamp')
+    }
+
+async def load_persisted_data(chatbot: Chatbot):
+    """Load persisted documents and links from disk concurrently."""
+    try:
+        # One directory scan per folder; documents are only loaded if their sidecar was listed
+        with os.scandir(UPLOADS_FOLDER) as entries:
+            names = {entry.name for entry in entries}
+        documents = [name for name in names if not name.endswith('.meta.json') and f"{name}.meta.json" in names]
+        with os.scandir(LINKS_FOLDER) as entries:
+            links = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)]
+        await asyncio.gather(
+            *[_load_document(chatbot, filename) for filename in documents],
+            *[_load_link(chatbot, link_dir) for link_dir in links]
+        )
+        chatbot.publish_documents()
+        chatbot.publish_links()
     except Exception as e:
         logger.error(f"Error loading persisted data: {e}")
 
-# Load persisted data on startup
-load_persisted_data()
-
 def allowed_file(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(ALLOWED_SUFFIXES)
 
 ################################################## Pydantic Models ##################################################
 class Message(BaseModel):
@@ -141,10 +289,13 @@ class ChatRequest(BaseModel):
 class LinkRequest(BaseModel):
     url: str
 
+class LinkBatchRequest(BaseModel):
+    urls: List[str]
+
 class ImageRequest(BaseModel):
     prompt: str
     negative_prompt: Optional[str] = ""
-    num_inference_steps: Optional[int] = 50
+    num_inference_steps: Optional[int] = None  # Defaults to the scheduler's step count
     guidance_scale: Optional[float] = 7.5
     width: Optional[int] = 512
     height: Optional[int] = 512
@@ -153,7 +304,6 @@ class ImageRequest(BaseModel):
 class DocumentResponse(BaseModel):
     id: str
     filename: str
-    content: str
     type: str
     size: int
     timestamp: str
@@ -163,7 +313,6 @@ class LinkResponse(BaseModel):
     url: str
     title: Optional[str]
     description: Optional[str]
-    content: Optional[str]
     timestamp: Optional[str]
 
 class MemoryResponse(BaseModel):
@@ -174,6 +323,21 @@ class ChatResponse(BaseModel):
     response: str
     searchResults: Optional[List[Dict[str, str]]] = None
 
+# Hot-path results are slotted dataclasses that orjson serializes directly,
+# skipping the pydantic round trip (the models above still document the schema)
+@dataclass(slots=True)
+class ChatResult:
+    response: str
+    searchResults: Optional[List[Dict[str, str]]] = None
+
+@dataclass(slots=True)
+class LinkSummary:
+    id: str
+    title: Optional[str]
+    description: Optional[str]
+    image: Optional[str]
+    timestamp: str
+
 class ImageResponse(BaseModel):
     image_url: str
     metadata: Dict[str, Any]
@@ -196,126 +360,385 @@ class MemoryViewerResponse(BaseModel):
 async def home():
     return {"message": "Welcome to the ChatBot API"}
 
+def validate_message(message: str):
+    """Reject empty or overlong chat input with a single length check."""
+    if not 0 < len(message) <= MAX_MESSAGE_CHARS:
+        raise HTTPException(status_code=400, detail="Input too long" if message else "Empty input")
+
+def chat_flags(request: ChatRequest) -> tuple[bool, bool]:
+    """Read the web search and reasoning flags once, tolerating a missing metadata object."""
+    metadata = request.metadata or {}
+    return bool(metadata.get('isWebSearch')), bool(metadata.get('isReasoningMode'))
+
+def chat_context_key(request: ChatRequest, chatbot: Chatbot) -> str:
+    """Hash everything besides the message that shapes a chat answer, including the version of referenced content."""
+    return hashlib.blake2b(orjson.dumps([
+        request.conversation_id,
+        request.document,
+        request.link,
+        request.user_id,
+        request.metadata,
+        # Listing ETags change whenever a document or link is added, replaced or deleted
+        chatbot.documents_etag if request.document else None,
+        chatbot.links_etag if request.link else None
+    ], option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+def lookup_semantic_cache(semantic_cache: Any, embedding: List[float], context_key: str) -> Optional[bytes]:
+    """Return the cached response body for the nearest earlier message in the same context, if close enough."""
+    hits = semantic_cache.query(
+        query_embeddings=[embedding],
+        n_results=1,
+        where={"context": context_key},
+        include=["documents", "distances", "metadatas"]
+    )
+    if not hits['ids'][0] or hits['distances'][0][0] >= SEMANTIC_CACHE_MAX_DISTANCE:
+        return None
+    if time.time() - hits['metadatas'][0][0]['created'] > CHAT_CACHE_TTL:
+        return None
+    return hits['documents'][0][0].encode()
+
+def store_semantic_cache(semantic_cache: Any, embedding: List[float], context_key: str, body: bytes):
+    """Store a response body under its message embedding for later near-duplicate lookups."""
+    semantic_cache.add(
+        ids=[uuid.uuid4().hex],
+        embeddings=[embedding],
+        documents=[body.decode()],
+        metadatas=[{"context": context_key, "created": time.time()}]
+    )
+
+async def prune_semantic_cache(semantic_cache: Any):
+    """Periodically delete semantic cache entries older than the chat cache lifetime."""
+    while True:
+        try:
+            await asyncio.to_thread(
+                semantic_cache.delete,
+                where={"created": {"$lt": time.time() - CHAT_CACHE_TTL}}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to prune semantic cache: {e}")
+        await asyncio.sleep(SEMANTIC_CACHE_PRUNE_INTERVAL)
+
+async def generate_chat_body(
+    request: ChatRequest,
+    chatbot: Chatbot,
+    semantic_cache: Any,
+    cache_key: bytes,
+    context_key: str,
+    cacheable: bool,
+    is_web_search: bool,
+    is_reasoning_mode: bool
+) -> bytes:
+    """Answer a chat request that missed the exact cache, returning and caching the serialized body."""
+    # Fall back to a near-duplicate message asked in the same context. Chroma calls are
+    # synchronous, so they run on a worker thread to keep other requests moving
+    embedding = None
+    if cacheable:
+        try:
+            embedding = await chatbot.memory_manager.get_embedding(request.message)
+            cached = await asyncio.to_thread(lookup_semantic_cache, semantic_cache, embedding, context_key)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            chat_cache[cache_key] = cached
+            chatbot.track_message(request.conversation_id, request.user_id)
+            return cached
+    
+    # Process the message using the Chatbot's process_message method
+    result = await chatbot.process_message(
+        user_input=request.message,
+        conversation_id=request.conversation_id,
+        document_name=request.document,
+        link_id=request.link,
+        is_reasoning_mode=is_reasoning_mode,
+        is_web_search=is_web_search,
+        user_id=request.user_id
+    )
+    
+    body = orjson.dumps(ChatResult(
+        response=result['response'],
+        searchResults=result.get('searchResults')
+    ))
+    if cacheable:
+        chat_cache[cache_key] = body
+        if embedding is not None:
+            try:
+                await asyncio.to_thread(store_semantic_cache, semantic_cache, embedding, context_key, body)
+            except Exception as e:
+                logger.warning(f"Failed to store semantic cache entry: {e}")
+    return body
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    start_time = datetime.now()
+async def chat(
+    request: ChatRequest,
+    chatbot: Chatbot = Depends(get_chatbot),
+    analytics_service: AnalyticsService = Depends(get_analytics_service),
+    semantic_cache: Any = Depends(get_semantic_cache)
+):
+    start_time = time.perf_counter()
+    
+    validate_message(request.message)
     
-    if not request.message:
-        raise HTTPException(status_code=400, detail="Empty input")
-    elif len(request.message) > 512:
-        raise HTTPException(status_code=400, detail="Input too long")
+    await wait_for_extraction(request.document)
     
     try:
-        # Process the message using the Chatbot's process_message method
-        result = await chatbot.process_message(
-            user_input=request.message,
-            conversation_id=request.conversation_id,
-            document_name=request.document,
-            link_id=request.link,
-            is_reasoning_mode=request.metadata.get('isReasoningMode', False),
-            is_web_search=request.metadata.get('isWebSearch', False),
-            user_id=request.user_id
-        )
+        # Serve exact repeats of a request from the cache, and hits return the serialized body as-is.
+        # Conversation turns depend on the history before them and web search results go stale,
+        # so neither is cached
+        is_web_search, is_reasoning_mode = chat_flags(request)
+        cacheable = not (is_web_search or request.conversation_id)
+        context_key = chat_context_key(request, chatbot)
+        cache_key = hashlib.blake2b(orjson.dumps([request.message, context_key]), digest_size=16).digest()
+        cached = chat_cache.get(cache_key) if cacheable else None
+        if cached is not None:
+            chatbot.track_message(request.conversation_id, request.user_id)
         
-        # Track response time
-        end_time = datetime.now()
-        response_time = (end_time - start_time).total_seconds()
-        analytics_service.track_response_time(response_time)
+        # Identical cacheable requests arriving while one is being answered share its result. The work
+        # runs in its own task so a caller disconnecting doesn't cancel it for the others. Conversation
+        # turns and web searches are always answered on their own
+        if cached is None and not cacheable:
+            cached = await generate_chat_body(
+                request, chatbot, semantic_cache, cache_key, context_key, cacheable, is_web_search, is_reasoning_mode
+            )
+        elif cached is None:
+            job = chat_inflight.get(cache_key)
+            if job is None:
+                job = asyncio.create_task(generate_chat_body(
+                    request, chatbot, semantic_cache, cache_key, context_key, cacheable, is_web_search, is_reasoning_mode
+                ))
+                chat_inflight[cache_key] = job
+                job.add_done_callback(lambda _: chat_inflight.pop(cache_key, None))
+            else:
+                chatbot.track_message(request.conversation_id, request.user_id)
+            cached = await asyncio.shield(job)
         
-        return ChatResponse(
-            response=result['response'],
-            searchResults=result.get('searchResults')
-        )
+        analytics_service.track_response_time(time.perf_counter() - start_time)
+        return Response(cached, media_type="application/json")
     except Exception as e:
         logger.error(f"Error in chat: {e}")
         analytics_service.track_error("chat_error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    chatbot: Chatbot = Depends(get_chatbot),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
+    """Stream the reply as Server-Sent Events so tokens show up before the model finishes."""
+    start_time = time.perf_counter()
+    
+    validate_message(request.message)
+    
+    await wait_for_extraction(request.document)
+    
+    is_web_search, is_reasoning_mode = chat_flags(request)
+    
+    async def events():
+        try:
+            async for event in chatbot.stream_message(
+                user_input=request.message,
+                conversation_id=request.conversation_id,
+                document_name=request.document,
+                link_id=request.link,
+                is_reasoning_mode=is_reasoning_mode,
+                is_web_search=is_web_search,
+                user_id=request.user_id
+            ):
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+        except Exception as e:
+            # Headers are already sent, so the failure is reported in-stream
+            logger.error(f"Error in chat stream: {e}")
+            analytics_service.track_error("chat_error")
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+            return
+        analytics_service.track_response_time(time.perf_counter() - start_time)
+        yield b"event: done\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 ################################################## Document Routes ##################################################
+def conditional_json(request: Request, body: bytes, etag: Optional[str]) -> Response:
+    """Return a precomputed JSON body, or a bodiless 304 when the client's copy is current."""
+    headers = {"Cache-Control": CACHE_CONTROL}
+    if etag is not None:
+        headers["ETag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def text_file_response(request: Request, path: str, stat_result: os.stat_result) -> Response:
+    """Serve a UTF-8 text file with its ETag, or a bodiless 304 when the client's copy is current."""
+    response = FileResponse(
+        path,
+        media_type="text/plain; charset=utf-8",
+        stat_result=stat_result,
+        headers={"Cache-Control": CACHE_CONTROL}
+    )
+    if request.headers.get("if-none-match") == response.headers["etag"]:
+        return Response(status_code=304, headers={"ETag": response.headers["etag"], "Cache-Control": CACHE_CONTROL})
+    return response
+
 @app.get("/documents", response_model=Dict[str, List[DocumentResponse]])
-async def list_documents():
-    documents = []
-    for filename, content in chatbot.documents.items():
-        metadata_path = os.path.join(UPLOADS_FOLDER, f"{filename}.meta.json")
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-                documents.append(DocumentResponse(
-                    id=filename,
-                    filename=filename,
-                    content=content,
-                    type=metadata.get('type', 'text/plain'),
-                    size=metadata.get('size', 0),
-                    timestamp=metadata.get('timestamp')
-                ))
-    return {"documents": documents}
+async def list_documents(request: Request, chatbot: Chatbot = Depends(get_chatbot)):
+    # The body is serialized once per change to the documents, not per request
+    return conditional_json(request, chatbot.documents_json, chatbot.documents_etag)
 
-@app.post("/document_upload", response_model=Dict[str, Any])
-async def upload_file(file: UploadFile = File(...)):
+@app.post("/document_upload", response_model=Dict[str, Any], status_code=202)
+async def upload_file(
+    file: UploadFile = File(...),
+    chatbot: Chatbot = Depends(get_chatbot),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     if not allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="File type not allowed")
     
     try:
-        content = await file.read()
         filepath = os.path.join(UPLOADS_FOLDER, file.filename)
         
-        with open(filepath, 'wb') as f:
-            f.write(content)
-        
-        content_text = chatbot.extract_text_from_file(filepath)
-        chatbot.documents[file.filename] = content_text
-        analytics_service.track_document_upload(file.filename, file.content_type, os.path.getsize(filepath))
+        # A previous upload of the same name must not overwrite this one
+        await _cancel_extraction(file.filename)
         
+        # Stream the upload to disk in fixed-size chunks, counting its size on the way
+        size = 0
+        async with aiofiles.open(filepath, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                await f.write(chunk)
         metadata = {
             'type': file.content_type,
-            'size': os.path.getsize(filepath),
-            'timestamp': datetime.utcnow().isoformat(),
-            'content': content_text
+            'size': size,
+            'timestamp': datetime.now(timezone.utc).isoformat()
         }
+        analytics_service.track_document_upload(file.filename, file.content_type, size)
         
-        chatbot.persist_document(file.filename, content_text, metadata)
+        # Extract in the background; the document is listed once its text is ready
+        job = asyncio.create_task(_extract_document(chatbot, file.filename, filepath, metadata))
+        extraction_jobs[file.filename] = job
+        job.add_done_callback(functools.partial(_finish_extraction, file.filename))
         
         return {
-            "message": "File uploaded successfully",
-            "content": content_text,
+            "message": "File uploaded, extracting text",
+            "job_id": file.filename,
             "metadata": metadata
         }
     except Exception as e:
         logger.error(f"Error processing file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _extract_document(chatbot: Chatbot, filename: str, filepath: str, metadata: Dict[str, Any]):
+    """Extract an uploaded document's text, then store, persist and list it."""
+    content_text = await chatbot.extract_text_from_file(filepath)
+
+    def store():
+        chatbot.persist_document(filename, content_text, {**metadata, 'content': content_text})
+        chatbot.documents[filename] = content_text
+
+    # Cancelling cannot stop the write thread, so the job only ends once it is done
+    persist = asyncio.ensure_future(asyncio.to_thread(store))
+    try:
+        await asyncio.shield(persist)
+    except asyncio.CancelledError:
+        await persist
+        raise
+    chatbot.document_meta[filename] = metadata
+    chatbot.list_document(filename)
+
+async def _cancel_extraction(filename: str):
+    """Cancel a document's extraction and wait until it has stopped writing to disk."""
+    job = extraction_jobs.pop(filename, None)
+    if job is not None:
+        job.cancel()
+        await asyncio.wait([job])
+
+def _finish_extraction(filename: str, job: asyncio.Task):
+    """Drop a finished extraction job, keeping failures around for status checks."""
+    if job.cancelled():
+        return
+    if job.exception() is not None:
+        logger.error(f"Error extracting text from {filename}: {job.exception()}")
+    elif extraction_jobs.get(filename) is job:
+        del extraction_jobs[filename]
+
+async def wait_for_extraction(filename: Optional[str]):
+    """Wait for a document's pending extraction so chats about it see its content."""
+    job = extraction_jobs.get(filename) if filename else None
+    if job is not None and not job.done():
+        await asyncio.wait([job])
+
+@app.get("/document_status/{filename}")
+async def document_status(filename: str, chatbot: Chatbot = Depends(get_chatbot)):
+    """Report whether an uploaded document's text has been extracted."""
+    job = extraction_jobs.get(filename)
+    if job is not None:
+        if not job.done():
+            return {"status": "processing"}
+        if job.exception() is not None:
+            return {"status": "failed", "detail": str(job.exception())}
+    if filename in chatbot.document_meta:
+        return {"status": "ready"}
+    raise HTTPException(status_code=404, detail="File not found")
+
+@app.get("/document_content/{filename}")
+async def get_document_content(filename: str, request: Request, chatbot: Chatbot = Depends(get_chatbot)):
+    """Serve a document's extracted text from disk; the listing leaves content out."""
+    # Only listed documents have been replaced on disk by their extracted text
+    if filename not in chatbot.document_meta:
+        raise HTTPException(status_code=404, detail="File not found")
+    filepath = os.path.join(UPLOADS_FOLDER, filename)
+    try:
+        stat_result = await asyncio.to_thread(os.stat, filepath)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    return text_file_response(request, filepath, stat_result)
+
 @app.post("/document_delete", response_model=Dict[str, str])
-async def delete_document(filename: str = Body(...)):
+async def delete_document(filename: str = Body(...), chatbot: Chatbot = Depends(get_chatbot)):
     if not filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
     filepath = os.path.join(UPLOADS_FOLDER, filename)
     metadata_path = os.path.join(UPLOADS_FOLDER, f"{filename}.meta.json")
-    
-    if not os.path.exists(filepath):
-        raise HTTPException(status_code=404, detail="File not found")
 
     try:
+        # Stop any extraction first so it cannot rewrite the files after they are removed
+        await _cancel_extraction(filename)
+        
+        # Remove from disk, letting a missing file signal the 404
+        try:
+            await asyncio.to_thread(os.remove, filepath)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+        try:
+            await asyncio.to_thread(os.remove, metadata_path)
+        except FileNotFoundError:
+            pass
+        
         # Remove from memory
         if filename in chatbot.documents:
             del chatbot.documents[filename]
-        
-        # Remove from disk
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        if os.path.exists(metadata_path):
-            os.remove(metadata_path)
+        chatbot.document_meta.pop(filename, None)
+        chatbot.unlist_document(filename)
         
         return {"response": "File deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 ################################################## Memory Routes ##################################################
-@app.post("/store_memory", response_model=Dict[str, Any])
-async def store_memory(request: MemoryRequest) -> Dict[str, Any]:
-    """Store a memory in the memory system."""
+@app.post("/store_memory", response_model=Dict[str, Any], status_code=202)
+async def store_memory(
+    request: MemoryRequest,
+    memory_manager: MemoryManager = Depends(get_memory_manager)
+) -> Dict[str, Any]:
+    """Queue a memory to be embedded and stored in the memory system."""
     try:
-        memory = await memory_manager.store_memory(
+        memory = await memory_manager.enqueue_memory(
             conversation_id=request.conversationId,
             user_message=request.userMessage.text,
             bot_message=request.botMessage.text,
@@ -323,15 +746,9 @@ async def store_memory(request: MemoryRequest) -> Dict[str, Any]:
             links=request.links
         )
         return {
-            "message": "Memory stored successfully",
+            "message": "Memory queued for storage",
             "memory": memory
         }
-    except aiohttp.ClientError as e:
-        logger.error(f"Error storing memory: {str(e)}")
-        raise HTTPException(
-            status_code=503,
-            detail="Embedding service unavailable"
-        )
     except Exception as e:
         logger.error(f"Error storing memory: {str(e)}")
         raise HTTPException(
@@ -339,44 +756,68 @@ async def store_memory(request: MemoryRequest) -> Dict[str, Any]:
             detail=f"Failed to store memory: {str(e)}"
         )
 
+def read_memory_page(memory_manager: MemoryManager, conversation_id: Optional[str], type: Optional[str],
+                     offset: int, page_size: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Read one page of memory entries and the total count across the matching collections (blocking)."""
+    # Collections are per conversation, so only the type needs a metadata filter
+    where = {"type": type} if type else None
+    paginated_entries = []
+    total = 0
+    
+    # Count each collection and fetch only the rows that fall on the requested page
+    for collection in memory_manager.list_collections(conversation_id):
+        count = memory_manager.count_memories(collection, type)
+        total += count
+        remaining = page_size - len(paginated_entries)
+        if remaining == 0 or offset >= count:
+            offset = max(offset - count, 0)
+            continue
+        
+        # Read the stored preview from metadata rather than transferring full documents
+        results = collection.get(where=where, limit=remaining, offset=offset, include=["metadatas"])
+        offset = 0
+        
+        # Entries stored before previews existed still need their document text
+        legacy_ids = [entry_id for entry_id, metadata in zip(results['ids'], results['metadatas']) if 'preview' not in metadata]
+        legacy_documents = {}
+        if legacy_ids:
+            legacy = collection.get(ids=legacy_ids, include=["documents"])
+            legacy_documents = dict(zip(legacy['ids'], legacy['documents']))
+        
+        for entry_id, metadata in zip(results['ids'], results['metadatas']):
+            if entry_id in legacy_documents:
+                document = legacy_documents[entry_id]
+                preview, length = document[:MEMORY_PREVIEW_CHARS], len(document)
+            else:
+                preview, length = metadata['preview'], metadata.get('length', 0)
+            paginated_entries.append({
+                'id': entry_id,
+                'conversation_id': metadata['conversation_id'],
+                'type': metadata['type'],
+                'timestamp': metadata['timestamp'],
+                'text': preview + '...' if length > MEMORY_PREVIEW_CHARS else preview
+            })
+    
+    return paginated_entries, total
+
 @app.get("/memory_viewer", response_model=MemoryViewerResponse)
 async def get_memory_entries(
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
     conversation_id: Optional[str] = None,
-    type: Optional[str] = None
+    type: Optional[str] = None,
+    memory_manager: MemoryManager = Depends(get_memory_manager)
 ) -> MemoryViewerResponse:
     """Retrieve memory entries with pagination and filtering."""
     try:
-        # Get all entries from ChromaDB
-        collection = memory_manager.collection
-        results = collection.get()
-        
-        # Filter entries
-        filtered_entries = []
-        for i in range(len(results['ids'])):
-            metadata = results['metadatas'][i]
-            if conversation_id and metadata['conversation_id'] != conversation_id:
-                continue
-            if type and metadata['type'] != type:
-                continue
-                
-            filtered_entries.append({
-                'id': results['ids'][i],
-                'conversation_id': metadata['conversation_id'],
-                'type': metadata['type'],
-                'timestamp': metadata['timestamp'],
-                'text': results['documents'][i][:200] + '...' if len(results['documents'][i]) > 200 else results['documents'][i]
-            })
-        
-        # Apply pagination
-        start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-        paginated_entries = filtered_entries[start_idx:end_idx]
+        # Chroma reads block, so the whole page is read on a worker thread
+        paginated_entries, total = await asyncio.to_thread(
+            read_memory_page, memory_manager, conversation_id, type, (page - 1) * page_size, page_size
+        )
         
         return MemoryViewerResponse(
             entries=paginated_entries,
-            total=len(filtered_entries),
+            total=total,
             page=page,
             page_size=page_size
         )
@@ -394,104 +835,85 @@ async def redirect_to_memory_viewer():
 
 ################################################## Link Routes ##################################################
 @app.get("/links", response_model=Dict[str, List[LinkResponse]])
-async def list_links():
+async def list_links(request: Request, chatbot: Chatbot = Depends(get_chatbot)):
     """Get a list of all processed links."""
     try:
-        links = []
-        for link_id, link_data in chatbot.links.items():
-            links.append(LinkResponse(
-                id=link_id,
-                url=link_data['url'],
-                title=link_data['title'],
-                description=link_data['description'],
-                content=link_data['content'],
-                timestamp=link_data['timestamp']
-            ))
-        return {"links": links}
+        return conditional_json(request, chatbot.links_json, chatbot.links_etag)
     except Exception as e:
         logger.error(f"Error listing links: {e}")
         raise HTTPException(status_code=500, detail=str(e))
     
+async def crawl_link(url: str, chatbot: Chatbot, analytics_service: AnalyticsService) -> LinkSummary:
+    """Fetch, persist, store and list one link."""
+    # Extract and store link data
+    link_data = await chatbot.extract_data_from_web_page(url)
+    
+    # More comprehensive URL sanitization
+    sanitized_url = url.replace('://', '_').translate(URL_SANITIZE_TABLE)
+    
+    # Ensure the sanitized URL is not empty
+    if not sanitized_url:
+        raise HTTPException(status_code=400, detail="URL could not be sanitized properly")
+        
+    # Create a unique identifier
+    now = datetime.now(timezone.utc)
+    link_id = f"{sanitized_url}_{now.timestamp()}"
+    
+    # Prepare link data
+    link_data = {
+        'url': url,
+        'title': link_data['title'],
+        'description': link_data['description'],
+        'image': link_data.get('image'),
+        'content': link_data.get('content', ''),
+        'timestamp': now.isoformat()
+    }
+    
+    # Store link using the Chatbot class method
+    await asyncio.to_thread(chatbot.persist_link, link_id, link_data)
+    
+    # Store in memory
+    chatbot.links[link_id] = link_data
+    chatbot.list_link(link_id, link_data)
+    
+    # Track link share in analytics with full information
+    try:
+        domain = url.split('/')[2]  # Extract domain from URL
+        analytics_service.track_link_share(
+            'default',
+            domain,
+            'anonymous',
+            title=link_data['title'],
+            url=url
+        )
+    except Exception as e:
+        logger.warning(f"Failed to track link share: {str(e)}")
+    
+    return LinkSummary(
+        id=link_id,
+        title=link_data['title'],
+        description=link_data['description'],
+        image=link_data.get('image'),
+        timestamp=link_data['timestamp']
+    )
+
 @app.post("/link_upload", response_model=Dict[str, Any])
-async def process_link(request: LinkRequest):
+async def process_link(
+    request: LinkRequest,
+    chatbot: Chatbot = Depends(get_chatbot),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     try:        
         # Validate URL
         if not request.url or not isinstance(request.url, str):
             raise HTTPException(status_code=400, detail="Invalid URL provided")
             
-        # Extract and store link data
-        link_data = await chatbot.extract_data_from_web_page(request.url)
-        
-        # More comprehensive URL sanitization
-        sanitized_url = (
-            request.url
-            .replace('://', '_')
-            .replace('/', '_')
-            .replace(':', '_')
-            .replace('?', '_')
-            .replace('&', '_')
-            .replace('=', '_')
-            .replace('+', '_')
-            .replace('@', '_')
-            .replace('#', '_')
-            .replace('%', '_')
-            .replace('*', '_')
-            .replace('|', '_')
-            .replace('\\', '_')
-            .replace('"', '_')
-            .replace("'", '_')
-            .replace('<', '_')
-            .replace('>', '_')
-            .replace(' ', '_')
-        )
-        
-        # Ensure the sanitized URL is not empty
-        if not sanitized_url:
-            raise HTTPException(status_code=400, detail="URL could not be sanitized properly")
-            
-        # Create a unique identifier
-        timestamp = datetime.utcnow().timestamp()
-        link_id = f"{sanitized_url}_{timestamp}"
+        link = await crawl_link(request.url, chatbot, analytics_service)
         
-        # Prepare link data
-        link_data = {
-            'url': request.url,
-            'title': link_data['title'],
-            'description': link_data['description'],
-            'image': link_data.get('image'),
-            'content': link_data.get('content', ''),
-            'timestamp': datetime.utcnow().isoformat()
-        }
-        
-        # Store link using the Chatbot class method
-        chatbot.persist_link(link_id, link_data)
-        
-        # Store in memory
-        chatbot.links[link_id] = link_data
-        
-        # Track link share in analytics with full information
-        try:
-            domain = request.url.split('/')[2]  # Extract domain from URL
-            analytics_service.track_link_share(
-                'default',
-                domain,
-                'anonymous',
-                title=link_data['title'],
-                url=request.url
-            )
-        except Exception as e:
-            logger.warning(f"Failed to track link share: {str(e)}")
-        
-        return {
+        return JSONResponse({
             "message": "Link processed successfully",
-            "link": {
-                "id": link_id,
-                "title": link_data['title'],
-                "description": link_data['description'],
-                "image": link_data.get('image'),
-                "timestamp": link_data['timestamp']
-            }
-        }
+            "link": link
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -499,33 +921,68 @@ async def process_link(request: LinkRequest):
         analytics_service.track_error("link_upload_error")
         raise HTTPException(status_code=500, detail=f"Failed to process link: {str(e)}")
 
+@app.post("/link_upload_batch", response_model=Dict[str, Any])
+async def process_links(
+    request: LinkBatchRequest,
+    chatbot: Chatbot = Depends(get_chatbot),
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
+    """Crawl several links concurrently, reporting failures per URL rather than failing the batch."""
+    urls = list(dict.fromkeys(url for url in request.urls if url))
+    if not urls:
+        raise HTTPException(status_code=400, detail="No URLs provided")
+    if len(urls) > MAX_LINK_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LINK_BATCH} URLs per batch")
+    
+    semaphore = asyncio.Semaphore(LINK_CRAWL_CONCURRENCY)
+    
+    async def crawl(url: str) -> LinkSummary:
+        async with semaphore:
+            return await crawl_link(url, chatbot, analytics_service)
+    
+    results = await asyncio.gather(*map(crawl, urls), return_exceptions=True)
+    
+    links, errors = [], []
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            detail = result.detail if isinstance(result, HTTPException) else str(result)
+            logger.error(f"Error processing link {url}: {detail}")
+            analytics_service.track_error("link_upload_error")
+            errors.append({"url": url, "detail": detail})
+        else:
+            links.append(result)
+    
+    return JSONResponse({
+        "message": f"Processed {len(links)} of {len(urls)} links",
+        "links": links,
+        "errors": errors
+    })
+
 @app.post("/link_delete", response_model=Dict[str, str])
-async def delete_link(request: dict = Body(...)):
+async def delete_link(request: dict = Body(...), chatbot: Chatbot = Depends(get_chatbot)):
     try:
         filename = request.get('filename')
         if not filename:
             raise HTTPException(status_code=400, detail="No filename provided")
             
-        # Get the full path to the link directory
-        link_dir = os.path.join(os.getcwd(), LINKS_FOLDER, filename)
-        
-        # Check if the directory exists
-        if not os.path.exists(link_dir):
-            raise HTTPException(status_code=404, detail="Link not found")
-            
-        # Remove from memory first
-        if filename in chatbot.links:
-            del chatbot.links[filename]
+        # Paths are relative to the working directory, like every other storage path
+        link_dir = os.path.join(LINKS_FOLDER, filename)
         
-        # Remove from disk
-        import shutil
+        # Remove from disk, letting a missing directory signal the 404
         try:
-            shutil.rmtree(link_dir)
+            await asyncio.to_thread(shutil.rmtree, link_dir)
             logger.info(f"Successfully deleted link directory: {link_dir}")
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Link not found")
         except Exception as e:
             logger.error(f"Error deleting link directory {link_dir}: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to delete link directory: {str(e)}")
         
+        # Remove from memory
+        if filename in chatbot.links:
+            del chatbot.links[filename]
+        chatbot.unlist_link(filename)
+        
         return {"response": "Link deleted successfully"}
     except HTTPException:
         raise
@@ -533,11 +990,29 @@ async def delete_link(request: dict = Body(...)):
         logger.error(f"Error in delete_link: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/link_content/{link_id}")
+async def get_link_content(link_id: str, request: Request):
+    """Serve a link's extracted text straight from disk, without a JSON envelope."""
+    # Link IDs are single directory names
+    if link_id in ('.', '..') or os.sep in link_id:
+        raise HTTPException(status_code=404, detail="Link not found")
+    content_path = os.path.join(LINKS_FOLDER, link_id, 'content.txt')
+    try:
+        stat_result = await asyncio.to_thread(os.stat, content_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Link not found")
+    
+    if LINK_ACCEL_PREFIX:
+        return Response(
+            media_type="text/plain; charset=utf-8",
+            headers={"X-Accel-Redirect": f"{LINK_ACCEL_PREFIX}/{link_id}/content.txt", "Cache-Control": CACHE_CONTROL}
+        )
+    return text_file_response(request, content_path, stat_result)
+
 ################################################## Image Routes ##################################################
 @app.post("/generate_image", response_model=ImageResponse)
-async def generate_image(request: ImageRequest):
+async def generate_image(request: ImageRequest, image_generator: ImageGenerator = Depends(get_image_generator)):
     try:
-        image_generator = ImageGenerator()
         result = await image_generator.generate_image(
             prompt=request.prompt,
             negative_prompt=request.negative_prompt,
@@ -553,10 +1028,10 @@ async def generate_image(request: ImageRequest):
             "metadata": {
                 "prompt": request.prompt,
                 "negative_prompt": request.negative_prompt,
-                "num_inference_steps": request.num_inference_steps,
+                "num_inference_steps": result["num_inference_steps"],
                 "guidance_scale": request.guidance_scale,
-                "width": request.width,
-                "height": request.height,
+                "width": result["width"],
+                "height": result["height"],
                 "seed": request.seed,
                 "generation_time": result["generation_time"]
             }
@@ -567,43 +1042,48 @@ async def generate_image(request: ImageRequest):
 
 ################################################## Analytics Routes ##################################################
 @app.websocket("/analytics")
-async def analytics_websocket(websocket: WebSocket):
+async def analytics_websocket(
+    websocket: WebSocket,
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     """WebSocket endpoint for real-time analytics updates."""
+    outbox = None
     try:
         await websocket.accept()
         logger.info("New analytics WebSocket connection accepted")
         
-        # Register with analytics service
-        await analytics_service.register_websocket(websocket)
+        # Register the client's outbox so service pushes are batched with replies
+        outbox = WebSocketOutbox(websocket)
+        await analytics_service.register_websocket(outbox)
         
         try:
             # Send initial data
-            await analytics_service._send_analytics_update(websocket)
+            await analytics_service._send_analytics_update(outbox)
             logger.debug("Initial analytics data sent successfully")
             
             # Keep connection alive and handle messages
             while True:
                 try:
-                    message = await websocket.receive_json()
+                    message = orjson.loads(await websocket.receive_text())
                     logger.debug(f"Received message: {message}")
                     
                     # Handle different message types
                     msg_type = message.get("type", "")
                     
                     if msg_type == "ping":
-                        await websocket.send_json({"type": "pong"})
+                        await outbox.send_json({"type": "pong"})
                     
                     elif msg_type == "subscribe":
                         topics = message.get("topics", [])
                         if isinstance(topics, list):
-                            await analytics_service.subscribe_to_topics(websocket, topics)
-                            await websocket.send_json({
+                            await analytics_service.subscribe_to_topics(outbox, topics)
+                            await outbox.send_json({
                                 "type": "subscribed",
                                 "topics": topics
                             })
                             logger.info(f"Client subscribed to topics: {topics}")
                         else:
-                            await websocket.send_json({
+                            await outbox.send_json({
                                 "type": "error",
                                 "message": "Topics must be a list"
                             })
@@ -611,37 +1091,40 @@ async def analytics_websocket(websocket: WebSocket):
                     elif msg_type == "unsubscribe":
                         topics = message.get("topics", [])
                         if isinstance(topics, list):
-                            await analytics_service.unsubscribe_from_topics(websocket, topics)
-                            await websocket.send_json({
+                            await analytics_service.unsubscribe_from_topics(outbox, topics)
+                            await outbox.send_json({
                                 "type": "unsubscribed",
                                 "topics": topics
                             })
                             logger.info(f"Client unsubscribed from topics: {topics}")
                         else:
-                            await websocket.send_json({
+                            await outbox.send_json({
                                 "type": "error",
                                 "message": "Topics must be a list"
                             })
                     
                     elif msg_type == "refresh":
-                        await analytics_service._send_analytics_update(websocket)
+                        await analytics_service._send_analytics_update(outbox)
                         logger.debug("Analytics data refreshed")
                     
                     else:
-                        await websocket.send_json({
+                        await outbox.send_json({
                             "type": "error",
                             "message": f"Unknown message type: {msg_type}"
                         })
                     
-                except JSONDecodeError as e:
+                except WebSocketDisconnect:
+                    # Replies are queued rather than sent inline, so nothing else would end the loop
+                    raise
+                except orjson.JSONDecodeError as e:
                     logger.error(f"Invalid JSON message received: {str(e)}")
-                    await websocket.send_json({
+                    await outbox.send_json({
                         "type": "error",
                         "message": "Invalid JSON message"
                     })
                 except Exception as e:
                     logger.error(f"Error handling message: {str(e)}")
-                    await websocket.send_json({
+                    await outbox.send_json({
                         "type": "error",
                         "message": "Internal server error"
                     })
@@ -651,7 +1134,7 @@ async def analytics_websocket(websocket: WebSocket):
         except Exception as e:
             logger.error(f"WebSocket connection error: {str(e)}")
             try:
-                await websocket.send_json({
+                await outbox.send_json({
                     "type": "error",
                     "message": "Connection error occurred"
                 })
@@ -662,37 +1145,48 @@ async def analytics_websocket(websocket: WebSocket):
     finally:
         # Ensure cleanup happens even if connection wasn't fully established
         try:
-            await analytics_service.unregister_websocket(websocket)
+            if outbox is not None:
+                await analytics_service.unregister_websocket(outbox)
+                await outbox.close()
             logger.info("WebSocket client unregistered")
         except Exception as e:
             logger.error(f"Error during WebSocket cleanup: {str(e)}")
 
 @app.get("/analytics/chat")
-async def get_chat_analytics(chat_id: Optional[str] = None):
+async def get_chat_analytics(
+    chat_id: Optional[str] = None,
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     """Get chat analytics data."""
     stats = analytics_service.get_chat_statistics(chat_id)
     return stats
 
 @app.get("/analytics/documents")
-async def get_document_analytics(chat_id: Optional[str] = None):
+async def get_document_analytics(
+    chat_id: Optional[str] = None,
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     """Get document analytics data."""
     stats = analytics_service.get_document_statistics(chat_id)
     return stats
 
 @app.get("/analytics/links")
-async def get_link_analytics(chat_id: Optional[str] = None):
+async def get_link_analytics(
+    chat_id: Optional[str] = None,
+    analytics_service: AnalyticsService = Depends(get_analytics_service)
+):
     """Get link analytics data."""
     stats = analytics_service.get_link_statistics(chat_id)
     return stats
 
 @app.get("/analytics/usage")
-async def get_usage_analytics():
+async def get_usage_analytics(analytics_service: AnalyticsService = Depends(get_analytics_service)):
     """Get usage analytics data."""
     stats = analytics_service.get_usage_statistics()
     return stats
 
 @app.get("/analytics/enhanced")
-async def get_enhanced_analytics():
+async def get_enhanced_analytics(analytics_service: AnalyticsService = Depends(get_analytics_service)):
     """Get enhanced analytics including detailed metrics for chats, documents, and users."""
     stats = analytics_service.get_enhanced_statistics()
     return stats
@@ -705,18 +1199,13 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
-    # Get the event loop
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    # Run the application
+    # Run the application on httptools, with uvloop picked automatically where installed (not on Windows)
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=5000,
-        loop="asyncio",
-        reload=True
+        loop="auto",
+        http="httptools",
+        reload=UVICORN_RELOAD,
+        access_log=UVICORN_ACCESS_LOG
     )
\ No newline at end of file
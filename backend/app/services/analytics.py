@@ -1,85 +1,65 @@
 import asyncio
+import itertools
 import logging
-import threading
-import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Dict, List, Optional, Set, Tuple
 
-from event_loop import get_event_loop
+import orjson
 from fastapi import WebSocket
 
+# Histories keep at most this many entries, oldest dropped first (share history is stored newest first)
+MESSAGE_HISTORY_SIZE = 1000
+UPLOAD_HISTORY_SIZE = 500
+SHARE_HISTORY_SIZE = 100
+RESPONSE_TIME_HISTORY_SIZE = 1000
+SESSION_HISTORY_SIZE = 1000
+
+# Changes tracked within this window after the first one go out together in a single update
+BROADCAST_COALESCE_WINDOW = 0.2  # seconds
+
+def _decrement(counts: Dict[str, Any], key: str, amount: Any):
+    """Subtract from a running count, dropping the key once it reaches zero."""
+    counts[key] -= amount
+    if counts[key] <= 0:
+        del counts[key]
+
+def _expire(history: deque, cutoff: datetime, newest_first: bool = False):
+    """Drop entries from the old end of a history until it is newer than the cutoff."""
+    if newest_first:
+        while history and history[-1]['timestamp'] <= cutoff:
+            history.pop()
+    else:
+        while history and history[0]['timestamp'] <= cutoff:
+            history.popleft()
 
 class AnalyticsService:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self._websocket_clients: Set[WebSocket] = set()
         self._client_topics: Dict[WebSocket, Set[str]] = defaultdict(set)
-        self._update_lock = threading.Lock()
+        # Every tracker, cleanup and broadcast runs on the event loop, so the stats below need no locks
+        # Upload and share ids are sequence numbers, unique even for events in the same microsecond
+        self._doc_id_counter = itertools.count()
+        self._link_id_counter = itertools.count()
+        
+        # Periodic cleanup and broadcast run as tasks on the server's loop, see start()
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self._broadcast_task: Optional[asyncio.Task] = None
+        # Topics changed since the last broadcast; the event wakes the broadcast task
+        self._dirty: Set[str] = set()
+        self._dirty_event = asyncio.Event()
+        # Update section key and getter for each topic, in the order sections are sent
+        self._sections = {
+            'chat': ('chatStats', self.get_chat_statistics),
+            'document': ('documentStats', self.get_document_statistics),
+            'link': ('linkStats', self.get_link_statistics),
+            'usage': ('usageStats', self.get_usage_statistics),
+            'enhanced': ('enhancedStats', self.get_enhanced_statistics)
+        }
         
-        # Get the configured event loop
-        try:
-            self._loop = asyncio.get_event_loop()
-        except RuntimeError:
-            self._loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self._loop)
-            
         # Reset all analytics data on startup
         self._reset_analytics_data()
-        
-        # Start cleanup and broadcast threads
-        self._cleanup_thread = threading.Thread(target=self._run_cleanup, daemon=True)
-        self._cleanup_thread.start()
-        self._broadcast_thread = threading.Thread(target=self._run_broadcast, daemon=True)
-        self._broadcast_thread.start()
-
-        # In-memory storage for analytics data
-        self._chat_stats = defaultdict(lambda: {
-            'message_count': 0,
-            'last_activity': None,
-            'document_count': 0,
-            'link_count': 0,
-            'active_users': set(),
-            'message_history': [],
-            'avg_response_time': [],
-            'completion_status': defaultdict(int),  # 'completed', 'abandoned'
-            'topics': defaultdict(int),  # Topic/intent tracking
-            'satisfaction_scores': []  # User feedback scores
-        })
-        self._document_stats = defaultdict(lambda: {
-            'count': 0,
-            'total_size': 0,
-            'types': defaultdict(int),
-            'upload_history': [],
-            'processing_times': [],
-            'success_rate': {'success': 0, 'failure': 0},
-            'access_count': defaultdict(int),  # Document reuse tracking
-            'search_queries': []  # Search terms used
-        })
-        self._link_stats = defaultdict(lambda: {
-            'count': 0,
-            'domains': defaultdict(int),
-            'share_history': [],
-            'health_status': defaultdict(lambda: {'active': True, 'last_check': None}),
-            'access_patterns': [],
-            'processing_times': []
-        })
-        self._usage_stats = {
-            'daily_active': set(),
-            'weekly_active': set(),
-            'monthly_active': set(),
-            'peak_hours': [0] * 24,
-            'concurrent_users': 0,
-            'response_times': [],
-            'error_rates': defaultdict(int),
-            'session_durations': [],
-            'feature_usage': defaultdict(int),
-            'retention': {
-                'daily': defaultdict(set),
-                'weekly': defaultdict(set),
-                'monthly': defaultdict(set)
-            }
-        }
 
     def _reset_analytics_data(self):
         """Reset all analytics data to initial state."""
@@ -89,7 +69,7 @@ class AnalyticsService:
             'document_count': 0,
             'link_count': 0,
             'active_users': set(),
-            'message_history': [],
+            'message_history': deque(maxlen=MESSAGE_HISTORY_SIZE),
             'avg_response_time': [],
             'completion_status': defaultdict(int),
             'topics': defaultdict(int),
@@ -99,7 +79,7 @@ class AnalyticsService:
             'count': 0,
             'total_size': 0,
             'types': defaultdict(int),
-            'upload_history': [],  # Explicitly reset upload history
+            'upload_history': deque(maxlen=UPLOAD_HISTORY_SIZE),  # Explicitly reset upload history
             'processing_times': [],
             'success_rate': {'success': 0, 'failure': 0},
             'access_count': defaultdict(int),
@@ -108,7 +88,7 @@ class AnalyticsService:
         self._link_stats = defaultdict(lambda: {
             'count': 0,
             'domains': defaultdict(int),
-            'share_history': [],  # Explicitly reset share history
+            'share_history': deque(maxlen=SHARE_HISTORY_SIZE),  # Explicitly reset share history
             'health_status': defaultdict(lambda: {'active': True, 'last_check': None}),
             'access_patterns': [],
             'processing_times': []
@@ -119,9 +99,9 @@ class AnalyticsService:
             'monthly_active': set(),
             'peak_hours': [0] * 24,
             'concurrent_users': 0,
-            'response_times': [],
+            'response_times': deque(maxlen=RESPONSE_TIME_HISTORY_SIZE),
             'error_rates': defaultdict(int),
-            'session_durations': [],
+            'session_durations': deque(maxlen=SESSION_HISTORY_SIZE),
             'feature_usage': defaultdict(int),
             'retention': {
                 'daily': defaultdict(set),
@@ -129,20 +109,41 @@ class AnalyticsService:
                 'monthly': defaultdict(set)
             }
         }
-        
-        # Start cleanup and broadcast threads
-        self._cleanup_thread = threading.Thread(target=self._run_cleanup, daemon=True)
-        self._cleanup_thread.start()
-        self._broadcast_thread = threading.Thread(target=self._run_broadcast, daemon=True)
-        self._broadcast_thread.start()
-
-    def _run_cleanup(self):
-        """Run cleanup in a separate thread."""
-        asyncio.run(self._periodic_cleanup())
-
-    def _run_broadcast(self):
-        """Run broadcast in a separate thread."""
-        asyncio.run(self._periodic_broadcast())
+        # Running totals across all chats, kept in step by the track_* methods so the
+        # aggregate getters don't rescan every chat
+        self._totals = {
+            'messages': 0,
+            'documents': 0,
+            'doc_size': 0,
+            'doc_types': defaultdict(int),
+            'doc_access': defaultdict(int),
+            'links': 0,
+            'domains': defaultdict(int),
+            'success': 0,
+            'failure': 0,
+            'completed': 0,
+            'completions': 0,
+            'response_time_sum': 0.0,
+            'response_time_count': 0,
+            'topics': defaultdict(int)
+        }
+        # Number of chats each user is active in, so a user is dropped along with their last chat
+        self._active_user_chats: Dict[str, int] = defaultdict(int)
+
+    async def start(self):
+        """Start the periodic cleanup and broadcast tasks on the running event loop."""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._periodic_cleanup())
+        if self._broadcast_task is None:
+            self._broadcast_task = asyncio.create_task(self._periodic_broadcast())
+
+    async def stop(self):
+        """Cancel the periodic tasks and wait for them to finish."""
+        tasks = [task for task in (self._cleanup_task, self._broadcast_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._cleanup_task = self._broadcast_task = None
 
     async def _periodic_cleanup(self):
         """Periodically clean up old data."""
@@ -155,17 +156,23 @@ class AnalyticsService:
                 await asyncio.sleep(60)  # Wait before retrying
 
     async def _periodic_broadcast(self):
-        """Periodically broadcast analytics updates to connected clients."""
+        """Broadcast the sections that changed to connected clients, coalescing changes close together."""
         while True:
             try:
-                await asyncio.sleep(5)  # Broadcast every 5 seconds
-                # Broadcast updates to all connected clients
-                for websocket in list(self._websocket_clients):
-                    try:
-                        await self._send_analytics_update(websocket)
-                    except Exception as e:
-                        self.logger.error(f"Error sending update to client: {e}")
-                        await self.unregister_websocket(websocket)
+                await self._dirty_event.wait()
+                await asyncio.sleep(BROADCAST_COALESCE_WINDOW)
+                self._dirty_event.clear()
+                topics, self._dirty = self._dirty, set()
+                if not self._websocket_clients:
+                    continue
+                # Gather the changed stats once and encode them once per distinct topic subscription
+                data = self._collect_analytics(topics)
+                prepared = {}
+                await self._send_to_clients({
+                    websocket: self._prepare_update(data, websocket, prepared)
+                    for websocket in list(self._websocket_clients)
+                    if self._is_subscribed(websocket, data)
+                })
             except Exception as e:
                 self.logger.error(f"Error in periodic broadcast: {e}")
                 await asyncio.sleep(1)  # Wait before retrying
@@ -196,23 +203,28 @@ class AnalyticsService:
 
     async def broadcast_update(self, update_type: str, data: Dict):
         """Broadcast an update to all subscribed WebSocket clients."""
-        disconnected_clients = set()
-
-        for websocket in self._websocket_clients:
-            try:
-                # Check if client is subscribed to this update type
-                if not self._client_topics[websocket] or update_type in self._client_topics[websocket]:
-                    await websocket.send_json({
-                        "type": update_type,
-                        "data": data
-                    })
-            except Exception as e:
-                self.logger.error(f"Error broadcasting to client: {e}")
-                disconnected_clients.add(websocket)
+        message = {
+            "type": update_type,
+            "data": data
+        }
+        # Only clients subscribed to this update type (or to everything) receive it
+        await self._send_to_clients({
+            websocket: message
+            for websocket in list(self._websocket_clients)
+            if not self._client_topics[websocket] or update_type in self._client_topics[websocket]
+        })
 
-        # Clean up disconnected clients
-        for websocket in disconnected_clients:
-            await self.unregister_websocket(websocket)
+    async def _send_to_clients(self, messages: Dict[WebSocket, Any]):
+        """Send each client its message concurrently, unregistering clients whose send fails."""
+        clients = list(messages)
+        results = await asyncio.gather(
+            *(websocket.send_json(messages[websocket]) for websocket in clients),
+            return_exceptions=True
+        )
+        for websocket, result in zip(clients, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error sending update to client: {result}")
+                await self.unregister_websocket(websocket)
 
     def _serialize_for_json(self, obj: Any) -> Any:
         """Convert objects to JSON-serializable format."""
@@ -228,68 +240,69 @@ class AnalyticsService:
             return [self._serialize_for_json(item) for item in obj]
         return obj
 
-    async def _send_analytics_update(self, websocket: WebSocket):
-        """Send analytics update to a specific WebSocket client."""
-        try:
-            # Get all stats
-            data = {
-                'chatStats': self._serialize_for_json(self.get_chat_statistics()),
-                'documentStats': self._serialize_for_json(self.get_document_statistics()),
-                'linkStats': self._serialize_for_json(self.get_link_statistics()),
-                'usageStats': self._serialize_for_json(self.get_usage_statistics()),
-                'enhancedStats': self._serialize_for_json(self.get_enhanced_statistics())
-            }
+    def _collect_analytics(self, topics: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """Gather the statistics sections for the given topics, or every section."""
+        return {
+            key: self._serialize_for_json(getter())
+            for topic, (key, getter) in self._sections.items()
+            if topics is None or topic in topics
+        }
 
+    def _is_subscribed(self, websocket: WebSocket, data: Dict[str, Any]) -> bool:
+        """Check whether a client's topics select any section of the update."""
+        topics = self._client_topics.get(websocket)
+        return not topics or any(topic in k.lower() for k in data for topic in topics)
+
+    def _mark_dirty(self, *topics: str):
+        """Flag topics as changed so the broadcast task sends them."""
+        self._dirty.update(topics)
+        self._dirty_event.set()
+
+    def _prepare_update(self, data: Dict[str, Any], websocket: WebSocket, prepared: Dict[frozenset, orjson.Fragment]) -> orjson.Fragment:
+        """Encode the update for a client's topics, reusing bytes already encoded for the same topics."""
+        topics = frozenset(self._client_topics.get(websocket, ()))
+        payload = prepared.get(topics)
+        if payload is None:
             # Filter based on subscribed topics
-            if self._client_topics[websocket]:
+            if topics:
                 data = {k: v for k, v in data.items() 
-                       if any(topic in k.lower() for topic in self._client_topics[websocket])}
+                       if any(topic in k.lower() for topic in topics)}
+            payload = prepared[topics] = orjson.Fragment(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+        return payload
 
-            await websocket.send_json(data)
+    async def _send_analytics_update(self, websocket: WebSocket):
+        """Send analytics update to a specific WebSocket client."""
+        try:
+            await websocket.send_json(self._prepare_update(self._collect_analytics(), websocket, {}))
         except Exception as e:
             self.logger.error(f"Error sending analytics update: {e}")
             await self.unregister_websocket(websocket)
 
-    def _broadcast_analytics_update(self):
-        """Broadcast analytics update to all connected clients."""
-        if not self._websocket_clients:
-            return
-
-        data = {
-            'chatStats': self._serialize_for_json(self.get_chat_statistics()),
-            'documentStats': self._serialize_for_json(self.get_document_statistics()),
-            'linkStats': self._serialize_for_json(self.get_link_statistics()),
-            'usageStats': self._serialize_for_json(self.get_usage_statistics()),
-            'enhancedStats': self._serialize_for_json(self.get_enhanced_statistics())
-        }
-
-        # Create tasks for each client
-        for websocket in list(self._websocket_clients):
-            try:
-                asyncio.run(websocket.send_json(data))
-            except Exception as e:
-                self.logger.error(f"Error broadcasting to client: {e}")
-                self._websocket_clients.remove(websocket)
-
     def track_chat_activity(self, chat_id: str, message_count: int = 1, user_id: Optional[str] = None):
         """Track chat activity and message count."""
-        with self._update_lock:
-            stats = self._chat_stats[chat_id]
-            stats['message_count'] += message_count
-            stats['last_activity'] = datetime.now()
+        now = datetime.now()
+        stats = self._chat_stats[chat_id]
+        stats['message_count'] += message_count
+        stats['last_activity'] = now
+        new_user = bool(user_id) and user_id not in stats['active_users']
+        if new_user:
+            stats['active_users'].add(user_id)
             
-            if user_id:
-                stats['active_users'].add(user_id)
-                
-            # Track message history
-            stats['message_history'].append({
-                'timestamp': datetime.now(),
-                'user_id': user_id,
-                'count': message_count
-            })
+        # Track message history
+        stats['message_history'].append({
+            'timestamp': now,
+            'user_id': user_id,
+            'count': message_count
+        })
+        
+        self._totals['messages'] += message_count
+        if new_user:
+            self._active_user_chats[user_id] += 1
+        self._mark_dirty('chat')
 
     def track_document_upload(self, chat_id: str, file_type: str, file_size: int, user_id: Optional[str] = None):
         """Track document upload statistics."""
+        now = datetime.now()
         chat_stats = self._chat_stats[chat_id]
         doc_stats = self._document_stats[chat_id]
         
@@ -300,16 +313,22 @@ class AnalyticsService:
         
         # Track upload history with filename
         doc_stats['upload_history'].append({
-            'id': f"doc_{datetime.now().timestamp()}",
+            'id': f"doc_{next(self._doc_id_counter)}",
             'name': f"Document {doc_stats['count']}",
-            'timestamp': datetime.now(),
+            'timestamp': now,
             'user_id': user_id,
             'file_type': file_type,
             'file_size': file_size
         })
+        
+        self._totals['documents'] += 1
+        self._totals['doc_size'] += file_size
+        self._totals['doc_types'][file_type] += 1
+        self._mark_dirty('chat', 'document', 'enhanced')
 
     def track_link_share(self, chat_id: str, domain: str, user_id: Optional[str] = None, title: Optional[str] = None, url: Optional[str] = None):
         """Track link sharing statistics."""
+        now = datetime.now()
         chat_stats = self._chat_stats[chat_id]
         link_stats = self._link_stats[chat_id]
         
@@ -317,22 +336,19 @@ class AnalyticsService:
         link_stats['count'] += 1
         link_stats['domains'][domain] += 1
         
-        # Track share history with detailed information
-        link_stats['share_history'].append({
-            'id': f"link_{datetime.now().timestamp()}",
+        # Track share history with detailed information, newest first
+        link_stats['share_history'].appendleft({
+            'id': f"link_{next(self._link_id_counter)}",
             'title': title or f"Link from {domain}",
             'url': url or f"https://{domain}",
-            'timestamp': datetime.now(),
+            'timestamp': now,
             'user_id': user_id,
             'domain': domain
         })
         
-        # Ensure the share history is sorted by timestamp (newest first)
-        link_stats['share_history'].sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        # Keep only the most recent 100 shares
-        if len(link_stats['share_history']) > 100:
-            link_stats['share_history'] = link_stats['share_history'][:100]
+        self._totals['links'] += 1
+        self._totals['domains'][domain] += 1
+        self._mark_dirty('chat', 'link')
 
     def track_user_activity(self, user_id: str):
         """Track user activity for engagement metrics."""
@@ -357,6 +373,7 @@ class AnalyticsService:
         
         # Update concurrent users
         self._usage_stats['concurrent_users'] = len(self._usage_stats['daily_active'])
+        self._mark_dirty('usage')
 
     def track_response_time(self, response_time: float):
         """Track response time for performance monitoring."""
@@ -364,13 +381,12 @@ class AnalyticsService:
             'timestamp': datetime.now(),
             'response_time': response_time
         })
-        # Keep only last 1000 response times
-        if len(self._usage_stats['response_times']) > 1000:
-            self._usage_stats['response_times'] = self._usage_stats['response_times'][-1000:]
+        self._mark_dirty('usage')
 
     def track_error(self, error_type: str):
         """Track error occurrences."""
         self._usage_stats['error_rates'][error_type] += 1
+        self._mark_dirty('usage')
 
     def track_chat_completion(self, chat_id: str, status: str, response_time: float, topic: Optional[str] = None):
         """Track chat completion status and response metrics."""
@@ -379,15 +395,23 @@ class AnalyticsService:
         stats['avg_response_time'].append(response_time)
         if topic:
             stats['topics'][topic] += 1
+        self._totals['completions'] += 1
+        if status == 'completed':
+            self._totals['completed'] += 1
+        self._totals['response_time_sum'] += response_time
+        self._totals['response_time_count'] += 1
+        if topic:
+            self._totals['topics'][topic] += 1
+        self._mark_dirty('enhanced')
 
     def track_document_processing(self, chat_id: str, doc_id: str, success: bool, processing_time: float):
         """Track document processing metrics."""
+        outcome = 'success' if success else 'failure'
         stats = self._document_stats[chat_id]
-        if success:
-            stats['success_rate']['success'] += 1
-        else:
-            stats['success_rate']['failure'] += 1
+        stats['success_rate'][outcome] += 1
         stats['processing_times'].append(processing_time)
+        self._totals[outcome] += 1
+        self._mark_dirty('enhanced')
 
     def track_document_access(self, chat_id: str, doc_id: str, search_query: Optional[str] = None):
         """Track document access and search patterns."""
@@ -399,11 +423,12 @@ class AnalyticsService:
                 'query': search_query,
                 'doc_id': doc_id
             })
+        self._totals['doc_access'][doc_id] += 1
+        self._mark_dirty('enhanced')
 
     def track_link_health(self, chat_id: str, domain: str, is_active: bool):
         """Track link health status."""
-        stats = self._link_stats[chat_id]
-        stats['health_status'][domain] = {
+        self._link_stats[chat_id]['health_status'][domain] = {
             'active': is_active,
             'last_check': datetime.now()
         }
@@ -417,6 +442,7 @@ class AnalyticsService:
         })
         for feature in features_used:
             self._usage_stats['feature_usage'][feature] += 1
+        self._mark_dirty('enhanced')
 
     def track_user_retention(self, user_id: str):
         """Track user retention metrics."""
@@ -427,63 +453,65 @@ class AnalyticsService:
         self._usage_stats['retention']['daily'][today].add(user_id)
         self._usage_stats['retention']['weekly'][week].add(user_id)
         self._usage_stats['retention']['monthly'][month].add(user_id)
+        self._mark_dirty('enhanced')
 
     def get_chat_statistics(self, chat_id: Optional[str] = None) -> Dict:
         """Get chat statistics for a specific chat or all chats."""
+        now = datetime.now()
+        hour_ago = now - timedelta(hours=1)
         if chat_id:
             stats = dict(self._chat_stats[chat_id])
             # Add real-time metrics
             stats['active_users_count'] = len(stats['active_users'])
             stats['recent_messages'] = [
                 msg for msg in stats['message_history']
-                if (datetime.now() - msg['timestamp']).total_seconds() < 3600
+                if msg['timestamp'] > hour_ago
             ]
             return stats
         
         total_stats = {
             'total_chats': len(self._chat_stats),
-            'total_messages': sum(stats['message_count'] for stats in self._chat_stats.values()),
-            'total_documents': sum(stats['document_count'] for stats in self._chat_stats.values()),
-            'total_links': sum(stats['link_count'] for stats in self._chat_stats.values()),
+            'total_messages': self._totals['messages'],
+            'total_documents': self._totals['documents'],
+            'total_links': self._totals['links'],
             'active_chats': sum(1 for stats in self._chat_stats.values() 
                               if stats['last_activity'] and 
-                              (datetime.now() - stats['last_activity']).days < 7),
-            'total_active_users': len(set().union(*[stats['active_users'] 
-                                                  for stats in self._chat_stats.values()]))
+                              (now - stats['last_activity']).days < 7),
+            'total_active_users': len(self._active_user_chats)
         }
         return total_stats
 
     def get_document_statistics(self, chat_id: Optional[str] = None) -> Dict:
         """Get document statistics for a specific chat or all chats."""
+        hour_ago = datetime.now() - timedelta(hours=1)
         if chat_id:
             stats = dict(self._document_stats[chat_id])
             # Add real-time metrics
             stats['recent_uploads'] = [
                 upload for upload in stats['upload_history']
-                if (datetime.now() - upload['timestamp']).total_seconds() < 3600
+                if upload['timestamp'] > hour_ago
             ]
             return stats
         
         total_stats = {
-            'total_documents': sum(stats['count'] for stats in self._document_stats.values()),
-            'total_size': sum(stats['total_size'] for stats in self._document_stats.values()),
-            'types': defaultdict(int),
+            'total_documents': self._totals['documents'],
+            'total_size': self._totals['doc_size'],
+            'types': dict(self._totals['doc_types']),
             'recent_uploads': []
         }
         
         for stats in self._document_stats.values():
-            for file_type, count in stats['types'].items():
-                total_stats['types'][file_type] += count
             # Add recent uploads from all chats
             total_stats['recent_uploads'].extend([
                 upload for upload in stats['upload_history']
-                if (datetime.now() - upload['timestamp']).total_seconds() < 3600
+                if upload['timestamp'] > hour_ago
             ])
                 
         return total_stats
 
     def get_link_statistics(self, chat_id: Optional[str] = None) -> Dict:
         """Get link statistics for a specific chat or all chats."""
+        hour_ago = datetime.now() - timedelta(hours=1)
         if chat_id:
             stats = dict(self._link_stats[chat_id])
             # Add real-time metrics
@@ -495,19 +523,17 @@ class AnalyticsService:
                     'timestamp': share['timestamp'].isoformat()
                 }
                 for share in stats['share_history']
-                if (datetime.now() - share['timestamp']).total_seconds() < 3600
+                if share['timestamp'] > hour_ago
             ]
             return stats
         
         total_stats = {
-            'total_links': sum(stats['count'] for stats in self._link_stats.values()),
-            'domains': defaultdict(int),
+            'total_links': self._totals['links'],
+            'domains': dict(self._totals['domains']),
             'recent_shares': []
         }
         
         for stats in self._link_stats.values():
-            for domain, count in stats['domains'].items():
-                total_stats['domains'][domain] += count
             # Add recent shares from all chats
             total_stats['recent_shares'].extend([
                 {
@@ -517,7 +543,7 @@ class AnalyticsService:
                     'timestamp': share['timestamp'].isoformat()
                 }
                 for share in stats['share_history']
-                if (datetime.now() - share['timestamp']).total_seconds() < 3600
+                if share['timestamp'] > hour_ago
             ])
                 
         return total_stats
@@ -525,9 +551,10 @@ class AnalyticsService:
     def get_usage_statistics(self) -> Dict:
         """Get usage statistics including active users and peak hours."""
         # Calculate average response time for last hour
+        hour_ago = datetime.now() - timedelta(hours=1)
         recent_response_times = [
             rt['response_time'] for rt in self._usage_stats['response_times']
-            if (datetime.now() - rt['timestamp']).total_seconds() < 3600
+            if rt['timestamp'] > hour_ago
         ]
         avg_response_time = sum(recent_response_times) / len(recent_response_times) if recent_response_times else 0
         
@@ -545,29 +572,17 @@ class AnalyticsService:
         """Get enhanced analytics including new metrics."""
         stats = {
             'chat_metrics': {
-                'avg_response_time': self._calculate_average([
-                    rt for stats in self._chat_stats.values()
-                    for rt in stats['avg_response_time']
-                ]),
+                'avg_response_time': (
+                    self._totals['response_time_sum'] / self._totals['response_time_count']
+                    if self._totals['response_time_count'] else 0
+                ),
                 'completion_rates': self._aggregate_completion_rates(),
-                'top_topics': self._get_top_items(
-                    [topics for stats in self._chat_stats.values() 
-                     for topics in stats['topics'].items()],
-                    limit=5
-                )
+                'top_topics': self._get_top_items(self._totals['topics'].items(), limit=5)
             },
             'document_metrics': {
                 'processing_success_rate': self._calculate_success_rate(),
-                'popular_types': self._get_top_items(
-                    [t for stats in self._document_stats.values() 
-                     for t in stats['types'].items()],
-                    limit=5
-                ),
-                'most_accessed': self._get_top_items(
-                    [acc for stats in self._document_stats.values() 
-                     for acc in stats['access_count'].items()],
-                    limit=5
-                )
+                'popular_types': self._get_top_items(self._totals['doc_types'].items(), limit=5),
+                'most_accessed': self._get_top_items(self._totals['doc_access'].items(), limit=5)
             },
             'user_metrics': {
                 'retention_rates': self._calculate_retention_rates(),
@@ -592,19 +607,11 @@ class AnalyticsService:
 
     def _aggregate_completion_rates(self) -> Dict[str, float]:
         """Calculate chat completion rates."""
-        total_completions = sum(
-            sum(status.values()) 
-            for stats in self._chat_stats.values() 
-            for status in [stats['completion_status']]
-        )
+        total_completions = self._totals['completions']
         if not total_completions:
             return {'completed': 0, 'abandoned': 0}
 
-        completed = sum(
-            status['completed'] 
-            for stats in self._chat_stats.values() 
-            for status in [stats['completion_status']]
-        )
+        completed = self._totals['completed']
         return {
             'completed': completed / total_completions,
             'abandoned': (total_completions - completed) / total_completions
@@ -612,18 +619,10 @@ class AnalyticsService:
 
     def _calculate_success_rate(self) -> float:
         """Calculate document processing success rate."""
-        total_processed = sum(
-            stats['success_rate']['success'] + stats['success_rate']['failure']
-            for stats in self._document_stats.values()
-        )
+        total_processed = self._totals['success'] + self._totals['failure']
         if not total_processed:
             return 0
-        
-        successful = sum(
-            stats['success_rate']['success']
-            for stats in self._document_stats.values()
-        )
-        return successful / total_processed
+        return self._totals['success'] / total_processed
 
     def _calculate_retention_rates(self) -> Dict[str, float]:
         """Calculate user retention rates."""
@@ -640,51 +639,67 @@ class AnalyticsService:
                       len(self._usage_stats['monthly_active']) if self._usage_stats['monthly_active'] else 0
         }
 
+    def _drop_chat(self, chat_id: str):
+        """Delete a chat's stats and take its contributions back out of the running totals."""
+        totals = self._totals
+        stats = self._chat_stats.pop(chat_id)
+        totals['messages'] -= stats['message_count']
+        for user_id in stats['active_users']:
+            _decrement(self._active_user_chats, user_id, 1)
+        totals['completions'] -= sum(stats['completion_status'].values())
+        totals['completed'] -= stats['completion_status'].get('completed', 0)
+        totals['response_time_sum'] -= sum(stats['avg_response_time'])
+        totals['response_time_count'] -= len(stats['avg_response_time'])
+        for topic, count in stats['topics'].items():
+            _decrement(totals['topics'], topic, count)
+        
+        doc_stats = self._document_stats.pop(chat_id, None)
+        if doc_stats is not None:
+            totals['documents'] -= doc_stats['count']
+            totals['doc_size'] -= doc_stats['total_size']
+            for file_type, count in doc_stats['types'].items():
+                _decrement(totals['doc_types'], file_type, count)
+            for doc_id, count in doc_stats['access_count'].items():
+                _decrement(totals['doc_access'], doc_id, count)
+            totals['success'] -= doc_stats['success_rate']['success']
+            totals['failure'] -= doc_stats['success_rate']['failure']
+        
+        link_stats = self._link_stats.pop(chat_id, None)
+        if link_stats is not None:
+            totals['links'] -= link_stats['count']
+            for domain, count in link_stats['domains'].items():
+                _decrement(totals['domains'], domain, count)
+
     def cleanup_old_data(self, days: int = 30):
         """Clean up data older than specified days."""
-        with self._update_lock:
-            cutoff_date = datetime.now() - timedelta(days=days)
-            
-            # Clean up chat stats
-            for chat_id, stats in list(self._chat_stats.items()):
-                if stats['last_activity'] and stats['last_activity'] < cutoff_date:
-                    del self._chat_stats[chat_id]
-                    if chat_id in self._document_stats:
-                        del self._document_stats[chat_id]
-                    if chat_id in self._link_stats:
-                        del self._link_stats[chat_id]
-                else:
-                    # Clean up message history
-                    stats['message_history'] = [
-                        msg for msg in stats['message_history']
-                        if msg['timestamp'] > cutoff_date
-                    ]
-            
-            # Clean up document stats
-            for stats in self._document_stats.values():
-                stats['upload_history'] = [
-                    upload for upload in stats['upload_history']
-                    if upload['timestamp'] > cutoff_date
-                ]
+        now = datetime.now()
+        cutoff_date = now - timedelta(days=days)
+        
+        # Clean up chat stats
+        for chat_id, stats in list(self._chat_stats.items()):
+            if stats['last_activity'] and stats['last_activity'] < cutoff_date:
+                self._drop_chat(chat_id)
+            else:
+                # Clean up message history
+                _expire(stats['message_history'], cutoff_date)
             
-            # Clean up link stats
-            for stats in self._link_stats.values():
-                stats['share_history'] = [
-                    share for share in stats['share_history']
-                    if share['timestamp'] > cutoff_date
-                ]
+        # Clean up document stats
+        for stats in self._document_stats.values():
+            _expire(stats['upload_history'], cutoff_date)
+        
+        # Clean up link stats
+        for stats in self._link_stats.values():
+            _expire(stats['share_history'], cutoff_date, newest_first=True)
+        
+        # Clean up usage stats
+        if now.day == 1:  # First day of month
+            self._usage_stats['monthly_active'].clear()
+        if now.weekday() == 0:  # Monday
+            self._usage_stats['weekly_active'].clear()
+        if now.hour == 0:  # Midnight
+            self._usage_stats['daily_active'].clear()
+            self._usage_stats['peak_hours'] = [0] * 24
             
-            # Clean up usage stats
-            if datetime.now().day == 1:  # First day of month
-                self._usage_stats['monthly_active'].clear()
-            if datetime.now().weekday() == 0:  # Monday
-                self._usage_stats['weekly_active'].clear()
-            if datetime.now().hour == 0:  # Midnight
-                self._usage_stats['daily_active'].clear()
-                self._usage_stats['peak_hours'] = [0] * 24
-                
-            # Clean up response times
-            self._usage_stats['response_times'] = [
-                rt for rt in self._usage_stats['response_times']
-                if rt['timestamp'] > cutoff_date
-            ] 
\ No newline at end of file
+        # Clean up response times
+        _expire(self._usage_stats['response_times'], cutoff_date)
+        self._mark_dirty(*self._sections) 
\ No newline at end of file
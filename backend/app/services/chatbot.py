@@ -1,24 +1,61 @@
-import json
+import asyncio
+import hashlib
 import logging
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from urllib.parse import urljoin
 
+import aiofiles
 import aiohttp
 import docx
+import orjson
 import PyPDF2
-import requests
-from bs4 import BeautifulSoup
-from werkzeug.utils import secure_filename
+from lxml import etree
+from lxml import html as lxml_html
 
 from .analytics import AnalyticsService
-from .llm_integration import LLMIntegration, ModelType
+from .content_store import ContentStore
+from .http_session import get_session
+from .llm_integration import LLMIntegration
 from .memory import MemoryManager
 from .response import ResponseGenerator
 from .web_search import WebSearchService
 
 logger = logging.getLogger(__name__)
 
+# Worker processes for CPU-bound PDF text extraction
+PDF_WORKERS = min(os.cpu_count() or 1, 4)
+_pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+
+# Fetched link metadata is reused for repeat URLs within this window
+URL_CACHE_SIZE = 256
+URL_CACHE_TTL = 600  # seconds
+
+# Compiled XPath lookups for link metadata extraction
+_META_XPATH = etree.XPath('//meta[@content][@property or @name] | //title | //link[contains(concat(" ", normalize-space(@rel), " "), " icon ")]')
+_FIRST_IMG_XPATH = etree.XPath('(//img/@src)[1]')
+_TEXT_XPATH = etree.XPath('.//text()[not(ancestor::script or ancestor::style)]')
+
+def _etag(body: bytes) -> str:
+    """Return a strong HTTP entity tag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def _count_pdf_pages(filepath: str) -> int:
+    """Count a PDF's pages (runs in a worker process)."""
+    with open(filepath, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def _extract_pdf_pages(filepath: str, start: int, stop: int) -> str:
+    """Extract text from a range of PDF pages (runs in a worker process)."""
+    with open(filepath, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        parts = [reader.pages[page_num].extract_text() or "" for page_num in range(start, stop)]
+    return "".join(parts)
+
 class Chatbot:
     """Main class for the chatbot application."""
 ################################################## Chatbot Constructor ##################################################
@@ -57,10 +94,28 @@ class Chatbot:
         for folder in [self.storage_folder, self.chats_folder, self.uploads_folder, self.links_folder]:
             os.makedirs(folder, exist_ok=True)
             
-        # Initialize storage
-        self.documents = {}
-        self.links = {}
-        self.load_persisted_data()
+        # Initialize storage, keeping document and link content on disk rather than in memory
+        content_db = os.path.join(self.storage_folder, "content.sqlite3")
+        self.documents = ContentStore(content_db, "documents")
+        self.links = ContentStore(content_db, "links")
+        # Document sidecar metadata (without content), kept in memory for listing
+        self.document_meta: Dict[str, dict] = {}
+        # Listing entries (without content) and their serialized bodies, updated one item at a time
+        self.document_listing: Dict[str, dict] = {}
+        self.link_listing: Dict[str, dict] = {}
+        self.documents_json = b'{"documents":[]}'
+        self.links_json = b'{"links":[]}'
+        self.documents_etag = self.links_etag = None
+        # Text extractors by lowercase file suffix
+        self._extractors = {
+            '.pdf': self.extract_text_from_pdf,
+            '.txt': self.extract_text_from_txt,
+            '.json': self.extract_text_from_json,
+            '.docx': self.extract_text_from_docx
+        }
+        self._url_cache: OrderedDict[bytes, tuple[Dict[str, Optional[str]], float]] = OrderedDict()
+        self.url_cache_hits = 0
+        self.url_cache_misses = 0
 
 ################################################## Message Processing ##################################################
     async def process_message(
@@ -88,73 +143,31 @@ class Chatbot:
             Dictionary containing the response and metadata
         """
         try:
-            # Track user activity
-            if user_id:
-                self.analytics_service.track_user_activity(user_id)
-            
-            # Track chat activity
-            chat_id = conversation_id or 'default'
-            self.analytics_service.track_chat_activity(chat_id, user_id=user_id)
-            
-            # Get relevant memories if conversation exists
-            memories = []
-            if conversation_id:
-                memories = await self.memory_manager.retrieve_relevant_memories(
-                    conversation_id,
-                    user_input
-                )
-            
-            # Generate response based on context
-            response_data = {}
-            if is_web_search:
-                # Perform web search and generate response
-                search_results = await self.web_search_service.search_web(user_input)
-                response_data = await self.response_generator.generate_web_search_response(
-                    user_input,
-                    search_results,
-                    is_reasoning_mode
-                )
-            elif document_name and document_name in self.documents:
-                response_data = await self.response_generator.generate_document_response(
-                    user_input,
-                    self.documents[document_name],
-                    is_reasoning_mode
-                )
-            elif link_id and link_id in self.links:
-                response_data = await self.response_generator.generate_link_response(
-                    user_input,
-                    self.links[link_id]['content'],
-                    is_reasoning_mode
-                )
-            elif memories:
-                response_data = await self.response_generator.generate_contextual_response(
-                    user_input,
-                    memories,
-                    is_reasoning_mode
-                )
-            else:
-                if is_reasoning_mode:
-                    response_data = await self.response_generator.generate_reasoned_response(user_input)
-                else:
-                    response_data = await self.response_generator.generate_simple_response(user_input)
+            memories, user_embedding = await self._prepare_message(user_input, conversation_id, user_id)
+            response_data = await self._generate_response(
+                user_input, memories, document_name, link_id, is_reasoning_mode, is_web_search
+            )
             
             # Ensure response_data is a string
+            search_results = None
             if isinstance(response_data, dict):
                 response_text = response_data.get('text', '')
+                search_results = response_data.get('searchResults')
             else:
                 response_text = str(response_data)
             
             # Track response time
             self.analytics_service.track_response_time(0)  # We'll need to track this differently
             
-            # Store the conversation in memory
+            # Queue the conversation for storage in memory
             if conversation_id:
-                await self.memory_manager.store_memory(
+                await self.memory_manager.enqueue_memory(
                     conversation_id,
                     user_input,
                     response_text,
                     [document_name] if document_name else None,
-                    [link_id] if link_id else None
+                    [link_id] if link_id else None,
+                    user_embedding=user_embedding
                 )
             
             return {
@@ -162,7 +175,8 @@ class Chatbot:
                 'conversation_id': conversation_id,
                 'document_name': document_name,
                 'link_id': link_id,
-                'is_reasoning_mode': is_reasoning_mode
+                'is_reasoning_mode': is_reasoning_mode,
+                'searchResults': search_results
             }
             
         except Exception as e:
@@ -170,47 +184,176 @@ class Chatbot:
             self.analytics_service.track_error("message_processing_error")
             raise
 
-################################################## Persistence ##################################################
-    def load_persisted_data(self):
-        """Load persisted documents and links from disk."""
+    async def stream_message(
+        self,
+        user_input: str,
+        conversation_id: Optional[str] = None,
+        document_name: Optional[str] = None,
+        link_id: Optional[str] = None,
+        is_reasoning_mode: bool = False,
+        is_web_search: bool = False,
+        user_id: Optional[str] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Process a user message, yielding the response as the model produces it.
+        
+        Web searches first yield a ``searchResults`` event; the response text then
+        arrives as ``delta`` events. The full text is stored in memory once streaming ends.
+        """
         try:
-            # Load documents
-            for filename in os.listdir(self.uploads_folder):
-                if filename.endswith('.meta.json'):
-                    continue
-                filepath = os.path.join(self.uploads_folder, filename)
-                metadata_path = os.path.join(self.uploads_folder, f"{filename}.meta.json")
-                
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, 'r') as f:
-                        metadata = json.load(f)
-                        self.documents[filename] = metadata.get('content', '')
+            memories, user_embedding = await self._prepare_message(user_input, conversation_id, user_id)
+            response_data = await self._generate_response(
+                user_input, memories, document_name, link_id, is_reasoning_mode, is_web_search, stream=True
+            )
+            
+            if isinstance(response_data, dict):
+                if response_data.get('searchResults'):
+                    yield {'searchResults': response_data['searchResults']}
+                response_data = response_data.get('text', '')
+            
+            # Canned replies (e.g. no search results) come back as plain strings
+            chunks = []
+            if isinstance(response_data, str):
+                chunks.append(response_data)
+                yield {'delta': response_data}
+            else:
+                async for chunk in response_data:
+                    chunks.append(chunk)
+                    yield {'delta': chunk}
+            
+            if conversation_id:
+                await self.memory_manager.enqueue_memory(
+                    conversation_id,
+                    user_input,
+                    "".join(chunks),
+                    [document_name] if document_name else None,
+                    [link_id] if link_id else None,
+                    user_embedding=user_embedding
+                )
             
-            # Load links
-            for link_dir in os.listdir(self.links_folder):
-                link_path = os.path.join(self.links_folder, link_dir)
-                if not os.path.isdir(link_path):
-                    continue
-                    
-                metadata_path = os.path.join(link_path, 'meta.json')
-                content_path = os.path.join(link_path, 'content.txt')
-                
-                if os.path.exists(metadata_path) and os.path.exists(content_path):
-                    with open(metadata_path, 'r') as f:
-                        metadata = json.load(f)
-                    with open(content_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        
-                    self.links[link_dir] = {
-                        'url': metadata.get('url'),
-                        'title': metadata.get('title'),
-                        'description': metadata.get('description'),
-                        'image': metadata.get('image'),
-                        'content': content,
-                        'timestamp': metadata.get('timestamp')
-                    }
         except Exception as e:
-            self.logger.error(f"Error loading persisted data: {e}")
+            self.logger.error(f"Error streaming message: {e}")
+            self.analytics_service.track_error("message_processing_error")
+            raise
+
+    def track_message(self, conversation_id: Optional[str], user_id: Optional[str]):
+        """Record a user's message in analytics, including messages answered from a cache."""
+        # Track user activity
+        if user_id:
+            self.analytics_service.track_user_activity(user_id)
+        
+        # Track chat activity
+        chat_id = conversation_id or 'default'
+        self.analytics_service.track_chat_activity(chat_id, user_id=user_id)
+
+    async def _prepare_message(
+        self,
+        user_input: str,
+        conversation_id: Optional[str],
+        user_id: Optional[str]
+    ) -> tuple[List[Dict[str, Any]], Optional[List[float]]]:
+        """Track the message and fetch relevant memories, returning them with the message embedding."""
+        self.track_message(conversation_id, user_id)
+        
+        # Get relevant memories if conversation exists, embedding the message once
+        # for both retrieval and storage
+        memories = []
+        user_embedding = None
+        if conversation_id:
+            user_embedding = await self.memory_manager.get_embedding(user_input)
+            memories = await self.memory_manager.retrieve_relevant_memories(
+                conversation_id,
+                query_embedding=user_embedding
+            )
+        return memories, user_embedding
+
+    async def _generate_response(
+        self,
+        user_input: str,
+        memories: List[Dict[str, Any]],
+        document_name: Optional[str],
+        link_id: Optional[str],
+        is_reasoning_mode: bool,
+        is_web_search: bool,
+        stream: bool = False
+    ) -> Any:
+        """Generate a response from whichever context applies.
+
+        Document and link content compose into one prompt and the simple/reasoned
+        model is picked once downstream.
+        """
+        generator = self.response_generator
+        doc_content = self.documents.get(document_name) if document_name else None
+        link = self.links.get(link_id) if link_id else None
+        link_content = link['content'] if link else None
+        if is_web_search:
+            search_results = await self.web_search_service.search_web(user_input)
+            return await generator.generate_web_search_response(
+                user_input, search_results, stream=stream, is_reasoning_mode=is_reasoning_mode
+            )
+        if doc_content or link_content:
+            return await generator.generate_combined_response(
+                user_input, doc_content, link_content, stream=stream, is_reasoning_mode=is_reasoning_mode
+            )
+        if memories:
+            return await generator.generate_contextual_response(
+                user_input, memories, stream=stream, is_reasoning_mode=is_reasoning_mode
+            )
+        return await generator.generate_response(user_input, stream=stream, is_reasoning_mode=is_reasoning_mode)
+
+################################################## Persistence ##################################################
+    def _document_entry(self, filename: str) -> dict:
+        """Build a document's listing entry from its sidecar metadata."""
+        metadata = self.document_meta[filename]
+        return {
+            'id': filename,
+            'filename': filename,
+            'type': metadata.get('type', 'text/plain'),
+            'size': metadata.get('size', 0),
+            'timestamp': metadata.get('timestamp')
+        }
+
+    @staticmethod
+    def _link_entry(link_id: str, link_data: dict) -> dict:
+        """Build a link's listing entry from its metadata."""
+        return {
+            'id': link_id,
+            'url': link_data.get('url'),
+            'title': link_data.get('title'),
+            'description': link_data.get('description'),
+            'timestamp': link_data.get('timestamp')
+        }
+
+    def list_document(self, filename: str, publish: bool = True):
+        """Add or replace one document in the listing; bulk loads publish once at the end."""
+        self.document_listing[filename] = self._document_entry(filename)
+        if publish:
+            self.publish_documents()
+
+    def unlist_document(self, filename: str):
+        """Remove one document from the listing."""
+        if self.document_listing.pop(filename, None) is not None:
+            self.publish_documents()
+
+    def list_link(self, link_id: str, link_data: dict, publish: bool = True):
+        """Add or replace one link in the listing; bulk loads publish once at the end."""
+        self.link_listing[link_id] = self._link_entry(link_id, link_data)
+        if publish:
+            self.publish_links()
+
+    def unlist_link(self, link_id: str):
+        """Remove one link from the listing."""
+        if self.link_listing.pop(link_id, None) is not None:
+            self.publish_links()
+
+    def publish_documents(self):
+        """Serialize the document listing and its ETag."""
+        self.documents_json = orjson.dumps({'documents': list(self.document_listing.values())})
+        self.documents_etag = _etag(self.documents_json)
+
+    def publish_links(self):
+        """Serialize the link listing and its ETag."""
+        self.links_json = orjson.dumps({'links': list(self.link_listing.values())})
+        self.links_etag = _etag(self.links_json)
 
     def persist_document(self, filename: str, content: str, metadata: dict):
         """Persist document and its metadata to disk."""
@@ -223,8 +366,8 @@ class Chatbot:
                 f.write(content)
             
             # Save metadata
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f)
+            with open(metadata_path, 'wb') as f:
+                f.write(orjson.dumps(metadata))
         except Exception as e:
             self.logger.error(f"Error persisting document: {e}")
 
@@ -237,8 +380,8 @@ class Chatbot:
             
             # Save metadata
             metadata_path = os.path.join(link_dir, 'meta.json')
-            with open(metadata_path, 'w') as f:
-                json.dump(link_data, f)
+            with open(metadata_path, 'wb') as f:
+                f.write(orjson.dumps(link_data))
             
             # Save content
             content_path = os.path.join(link_dir, 'content.txt')
@@ -249,141 +392,172 @@ class Chatbot:
     
     async def close(self):
         """Clean up resources."""
-        await self.llm_integration.close()
+        await self.memory_manager.close()
+        self.documents.close()
+        self.links.close()
 
 ################################################## File Processing ##################################################
-    def extract_text_from_pdf(self, filepath: str) -> str:
-        """Extract text from PDF file."""
-        text = ""
+    async def extract_text_from_pdf(self, filepath: str) -> str:
+        """Extract text from PDF file, splitting pages across worker processes."""
         try:
-            with open(filepath, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(reader.pages)):
-                    text += reader.pages[page_num].extract_text()
-            return text
+            loop = asyncio.get_running_loop()
+            num_pages = await loop.run_in_executor(_pdf_pool, _count_pdf_pages, filepath)
+            if not num_pages:
+                return ""
+
+            # One contiguous page range per worker so each process opens the file once
+            chunk_size = -(-num_pages // PDF_WORKERS)
+            results = await asyncio.gather(*[
+                loop.run_in_executor(
+                    _pdf_pool, _extract_pdf_pages, filepath, start, min(start + chunk_size, num_pages)
+                )
+                for start in range(0, num_pages, chunk_size)
+            ])
+            return "".join(results)
         except FileNotFoundError:
             return "Error file not found"
         except Exception as e:
             return f"Error: {e}"
 
-    def extract_text_from_txt(self, filepath: str) -> str:
+    async def extract_text_from_txt(self, filepath: str) -> str:
         """Extract text from TXT file."""
         try:
-            with open(filepath, 'r') as file:
-                return file.read()
+            async with aiofiles.open(filepath, 'r') as file:
+                return await file.read()
         except FileNotFoundError:
             return "Error file not found"
         except Exception as e:
             return f"Error: {e}"
 
-    def extract_text_from_json(self, filepath: str) -> str:
+    async def extract_text_from_json(self, filepath: str) -> str:
         """Extract text from JSON file."""
         try:
-            with open(filepath, 'r') as file:
-                data = json.load(file)
-                return json.dumps(data, indent=4)
+            async with aiofiles.open(filepath, 'rb') as file:
+                data = orjson.loads(await file.read())
+                return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
         except FileNotFoundError:
             return "Error file not found"
         except Exception as e:
             return f"Error: {e}"
 
-    def extract_text_from_docx(self, filepath: str) -> str:
+    async def extract_text_from_docx(self, filepath: str) -> str:
         """Extract text from DOCX file."""
         try:
-            doc = docx.Document(filepath)
+            doc = await asyncio.to_thread(docx.Document, filepath)
             return "\n".join([para.text for para in doc.paragraphs])
         except FileNotFoundError:
             return "Error file not found"
         except Exception as e:
             return f"Error: {e}"
 
-    def extract_text_from_file(self, filepath: str) -> str:
+    async def extract_text_from_file(self, filepath: str) -> str:
         """Extract text from various file types."""
-        ext = filepath.rsplit('.', 1)[1].lower()
-        if ext == 'pdf':
-            return self.extract_text_from_pdf(filepath)
-        elif ext == 'txt':
-            return self.extract_text_from_txt(filepath)
-        elif ext == 'json':
-            return self.extract_text_from_json(filepath)
-        elif ext == 'docx':
-            return self.extract_text_from_docx(filepath)
-        return ""
+        extractor = self._extractors.get(os.path.splitext(filepath)[1].lower())
+        if extractor is None:
+            return ""
+        return await extractor(filepath)
 
 ################################################## Web Processing ##################################################
-    def extract_metadata(self, url: str) -> Dict[str, Optional[str]]:
+    async def extract_metadata(self, url: str) -> Dict[str, Optional[str]]:
         """Extract metadata from a web page."""
         try:
-            # Fetch the webpage content
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            # Fetch the webpage content over the pooled session
+            session = await get_session()
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                response.raise_for_status()
+                # Raw bytes let lxml honour the page's own encoding declaration
+                html = await response.read()
             
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
+            if not html.strip():
+                return {'title': url, 'description': None, 'image': None, 'content': ''}
             
+            # Parse the HTML content with lxml
+            tree = lxml_html.fromstring(html)
+            
+            # Collect meta, title and icon tags with one compiled XPath query
+            meta_by_property, meta_by_name = {}, {}
+            title_text = favicon = None
+            for element in _META_XPATH(tree):
+                if element.tag == 'meta':
+                    content = element.get('content')
+                    if element.get('property'):
+                        meta_by_property.setdefault(element.get('property'), content)
+                    if element.get('name'):
+                        meta_by_name.setdefault(element.get('name'), content)
+                elif element.tag == 'title':
+                    title_text = title_text or element.text_content()
+                elif favicon is None:
+                    favicon = element.get('href')
+
             # Extract title
-            title = None
-            og_title = soup.find('meta', property='og:title')
-            if og_title:
-                title = og_title.get('content')
-            if not title:
-                title = soup.find('title')
-                title = title.text if title else None
-            if not title:
-                title = url
+            title = meta_by_property.get('og:title') or title_text or url
                 
             # Extract description
-            description = None
-            og_desc = soup.find('meta', property='og:description')
-            if og_desc:
-                description = og_desc.get('content')
-            if not description:
-                meta_desc = soup.find('meta', attrs={'name': 'description'})
-                description = meta_desc.get('content') if meta_desc else None
+            description = meta_by_property.get('og:description') or meta_by_name.get('description')
                 
-            # Extract image - Try multiple sources
-            image = None
-            # Try Open Graph image first
-            og_image = soup.find('meta', property='og:image')
-            if og_image:
-                image = og_image.get('content')
-            # Try Twitter card image
-            if not image:
-                twitter_image = soup.find('meta', name='twitter:image')
-                if twitter_image:
-                    image = twitter_image.get('content')
-            # Try first image in article
+            # Extract image - Open Graph, Twitter card, first image, then favicon
+            image = meta_by_property.get('og:image') or meta_by_name.get('twitter:image')
             if not image:
-                article_image = soup.find('img')
-                if article_image:
-                    image = article_image.get('src')
-            # Try favicon as last resort
-            if not image:
-                favicon = soup.find('link', rel='icon') or soup.find('link', rel='shortcut icon')
-                if favicon:
-                    image = favicon.get('href')
+                article_image = _FIRST_IMG_XPATH(tree)
+                image = article_image[0] if article_image else favicon
                 
             # Make image URL absolute if it's relative
             if image and not image.startswith(('http://', 'https://')):
-                from urllib.parse import urljoin
                 image = urljoin(url, image)
+
+            body = tree.find('body')
+            text_nodes = _TEXT_XPATH(body if body is not None else tree)
                 
             return {
                 'title': title,
                 'description': description,
                 'image': image,
-                'content': soup.get_text(separator=' ', strip=True)
+                'content': ' '.join(text.strip() for text in text_nodes if text.strip())
             }        
-        except requests.exceptions.RequestException as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise Exception(f'Failed to fetch URL: {str(e)}')
         except Exception as e:
             raise Exception(f'An error occurred: {str(e)}')
 
+    def _get_cached_metadata(self, key: bytes) -> Optional[Dict[str, Optional[str]]]:
+        """Return cached metadata for a URL hash if it has not expired."""
+        cached = self._url_cache.get(key)
+        if cached is None:
+            return None
+        metadata, expires_at = cached
+        if expires_at <= time.monotonic():
+            del self._url_cache[key]
+            return None
+        self._url_cache.move_to_end(key)
+        return metadata
+
+    def _cache_metadata(self, key: bytes, metadata: Dict[str, Optional[str]]):
+        """Store metadata for a URL hash, evicting the least recently used entry."""
+        self._url_cache[key] = (metadata, time.monotonic() + URL_CACHE_TTL)
+        self._url_cache.move_to_end(key)
+        if len(self._url_cache) > URL_CACHE_SIZE:
+            self._url_cache.popitem(last=False)
+
+    def get_url_cache_stats(self) -> Dict[str, int]:
+        """Get size and hit/miss counters of the link metadata cache."""
+        return {
+            'cache_size': len(self._url_cache),
+            'hits': self.url_cache_hits,
+            'misses': self.url_cache_misses
+        }
+
     async def extract_data_from_web_page(self, url: str) -> Dict[str, Any]:
         """Extract data from a web page."""
         try:
-            # Extract metadata
-            metadata = self.extract_metadata(url)
+            # Extract metadata, reusing a recent fetch of the same URL
+            key = hashlib.sha256(url.encode()).digest()
+            metadata = self._get_cached_metadata(key)
+            if metadata is None:
+                self.url_cache_misses += 1
+                metadata = await self.extract_metadata(url)
+                self._cache_metadata(key, metadata)
+            else:
+                self.url_cache_hits += 1
             
             # Create link data structure
             link_data = {
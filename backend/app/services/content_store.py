@@ -0,0 +1,90 @@
+import logging
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Iterator, List, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Bytes of the database file SQLite reads through a memory map instead of read() calls
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+class ContentStore(MutableMapping):
+    """Dict-like store that keeps values in a SQLite table instead of process memory.
+
+    Values are JSON encoded, so both plain document text and link dicts can be stored.
+    Reads go to disk on demand through a memory map, so content pages live in the
+    OS page cache and are shared by every worker process.
+    """
+
+    def __init__(self, db_path: str, table: str):
+        self.db_path = db_path
+        self.table = table
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (name TEXT PRIMARY KEY, content TEXT NOT NULL)"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error opening content store {db_path}: {e}")
+            raise
+
+    def __getitem__(self, name: str) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT content FROM {self.table} WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return orjson.loads(row[0])
+
+    def __setitem__(self, name: str, value: Any):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (name, content) VALUES (?, ?)",
+                (name, orjson.dumps(value).decode())
+            )
+            self._conn.commit()
+
+    def __delitem__(self, name: str):
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE name = ?", (name,))
+            self._conn.commit()
+        if cursor.rowcount == 0:
+            raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE name = ?", (name,)
+            ).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def keys(self) -> List[str]:
+        """Return all names without loading their content."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(f"SELECT name FROM {self.table}")]
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Return all entries with a single query."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT name, content FROM {self.table}").fetchall()
+        return [(name, orjson.loads(content)) for name, content in rows]
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Optional
+
+import aiohttp
+import orjson
+
+# Connection pool shared by every outbound HTTP call (Ollama, web pages, search)
+HTTP_POOL_LIMIT = 64
+# Cap per host so crawls of one slow site can't take every connection Ollama needs
+HTTP_POOL_LIMIT_PER_HOST = 32
+# Resolved hostnames are reused for this long instead of the 10 second aiohttp default
+HTTP_DNS_CACHE_TTL = 300  # seconds
+HTTP_KEEPALIVE_TIMEOUT = 75  # seconds
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_lock = asyncio.Lock()
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the process-wide HTTP session, creating it on first use."""
+    global _session
+    if _session is None or _session.closed:
+        async with _session_lock:
+            if _session is None or _session.closed:
+                _session = aiohttp.ClientSession(
+                    json_serialize=lambda obj: orjson.dumps(obj).decode(),
+                    connector=aiohttp.TCPConnector(
+                        limit=HTTP_POOL_LIMIT,
+                        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                        ttl_dns_cache=HTTP_DNS_CACHE_TTL
+                    )
+                )
+    return _session
+
+
+async def close_session():
+    """Close the process-wide HTTP session."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
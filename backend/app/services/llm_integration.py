@@ -1,11 +1,14 @@
 import asyncio
-import json
-import time
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, Generator, Optional
+from typing import Dict, Optional
 
-import aiohttp
+import orjson
+
+from .http_session import get_session
+
+# Request bodies are posted as pre-encoded JSON bytes
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class ModelType(Enum):
@@ -35,12 +38,12 @@ class LLMIntegration:
     async def check_model_health(self, model_name: str) -> bool:
         """Check if the model is available and responding."""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.api_url,
-                    json={"model": model_name, "prompt": "test", "stream": False}
-                ) as response:
-                    return response.status == 200
+            session = await get_session()
+            async with session.post(
+                self.api_url,
+                json={"model": model_name, "prompt": "test", "stream": False}
+            ) as response:
+                return response.status == 200
         except:
             return False
 
@@ -80,45 +83,48 @@ class LLMIntegration:
             "frequency_penalty": kwargs.get('frequency_penalty', model_config.frequency_penalty),
             "presence_penalty": kwargs.get('presence_penalty', model_config.presence_penalty)
         }
+        # Encode straight to bytes once, rather than to a str that aiohttp encodes again on every attempt
+        body = orjson.dumps(data)
 
         for attempt in range(self.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
-                    if stream:
-                        async def stream_response():
-                            async with session.post(self.api_url, json=data) as response:
-                                if response.status == 200:
-                                    async for line in response.content:
-                                        if line:
-                                            try:
-                                                json_response = line.decode('utf-8')
-                                                if json_response.startswith('data: '):
-                                                    json_response = json_response[6:]
-                                                response_data = json.loads(json_response)
-                                                if 'response' in response_data:
-                                                    yield response_data['response']
-                                            except Exception as e:
-                                                print(f"Error processing stream: {e}")
-                                                continue
-                        return stream_response()
-                    else:
-                        async with session.post(self.api_url, json=data) as response:
+                session = await get_session()
+                if stream:
+                    async def stream_response():
+                        async with session.post(self.api_url, data=body, headers=JSON_HEADERS) as response:
                             if response.status == 200:
-                                result = (await response.json()).get("response", "")
-                                
-                                # Update conversation history if available
-                                if conversation_id:
-                                    if conversation_id not in self.conversation_history:
-                                        self.conversation_history[conversation_id] = []
-                                    self.conversation_history[conversation_id].extend([prompt, result])
-                                    # Keep only last 10 exchanges
-                                    if len(self.conversation_history[conversation_id]) > 20:
-                                        self.conversation_history[conversation_id] = self.conversation_history[conversation_id][-20:]
-                                
-                                return result
+                                async for line in response.content:
+                                    if line:
+                                        try:
+                                            if line.startswith(b'data: '):
+                                                line = line[6:]
+                                            response_data = orjson.loads(line)
+                                            if 'response' in response_data:
+                                                yield response_data['response']
+                                        except Exception as e:
+                                            print(f"Error processing stream: {e}")
+                                            continue
                             else:
                                 raise Exception(f"API returned status code {response.status}")
-                
+                    return stream_response()
+                else:
+                    async with session.post(self.api_url, data=body, headers=JSON_HEADERS) as response:
+                        if response.status == 200:
+                            result = (await response.json(loads=orjson.loads)).get("response", "")
+                            
+                            # Update conversation history if available
+                            if conversation_id:
+                                if conversation_id not in self.conversation_history:
+                                    self.conversation_history[conversation_id] = []
+                                self.conversation_history[conversation_id].extend([prompt, result])
+                                # Keep only last 10 exchanges
+                                if len(self.conversation_history[conversation_id]) > 20:
+                                    self.conversation_history[conversation_id] = self.conversation_history[conversation_id][-20:]
+                            
+                            return result
+                        else:
+                            raise Exception(f"API returned status code {response.status}")
+            
             except Exception as e:
                 if attempt == self.max_retries - 1:
                     raise Exception(f"Failed after {self.max_retries} attempts: {str(e)}")
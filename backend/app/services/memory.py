@@ -1,164 +1,446 @@
-import json
+import asyncio
+import functools
+import hashlib
 import logging
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
 import aiohttp
 import chromadb
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
+from .http_session import get_session
+
+try:
+    import torch
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
 
 logger = logging.getLogger(__name__)
 
+# Embedding backend: a small local sentence-transformers model, or "ollama" for the Ollama API
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "sentence-transformers")
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+EMBEDDING_CACHE_SIZE = 1024
+EMBEDDING_CACHE_TTL = 3600  # seconds
+
+# ChromaDB storage: a local persistent store by default, or a Chroma server if CHROMA_HOST is set
+CHROMA_PATH = os.environ.get("CHROMA_PATH", "./chroma_store")
+CHROMA_HOST = os.environ.get("CHROMA_HOST")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+
+# Each conversation's memories live in their own collection with this name prefix
+COLLECTION_PREFIX = "mem_"
+
+# HNSW index tuning (higher ef trades latency for recall)
+HNSW_M = int(os.environ.get("CHROMA_HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.environ.get("CHROMA_HNSW_CONSTRUCTION_EF", "200"))
+HNSW_SEARCH_EF = int(os.environ.get("CHROMA_HNSW_SEARCH_EF", "50"))
+
+# Queued memories are written in batches of up to this many entries
+MEMORY_BATCH_INTERVAL = 0.05  # seconds
+MEMORY_MAX_BATCH_SIZE = 32
+
+# Characters of each memory's text kept in its metadata for list views
+MEMORY_PREVIEW_CHARS = 200
+
+# Per-type memory counts for list views; writes through this process keep them current, and
+# the TTL bounds how stale they get when other processes share a Chroma server
+MEMORY_COUNT_CACHE_SIZE = 1024
+MEMORY_COUNT_CACHE_TTL = 300  # seconds
+
+# Retrieval over-fetches candidates and re-ranks them with Maximal Marginal Relevance
+MMR_FETCH_FACTOR = 3
+MMR_LAMBDA = 0.5  # 1.0 ranks purely by relevance, 0.0 purely by diversity
+
+def _mmr_select(query_embedding: List[float], embeddings: List[List[float]], limit: int,
+                lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """Pick indices of embeddings that are relevant to the query but not redundant with each other."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-12
+
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    max_similarity = np.full(len(vectors), -np.inf, dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+
+    selected = []
+    for _ in range(min(limit, len(vectors))):
+        # Nothing is selected yet on the first pass, so rank by relevance alone
+        redundancy = max_similarity if selected else 0.0
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        np.maximum(max_similarity, similarity[chosen], out=max_similarity)
+    return selected
+
+@functools.lru_cache(maxsize=None)
+def _load_local_model(model_name: str) -> "SentenceTransformer":
+    """Load a sentence-transformers model once per process."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Loading local embedding model {model_name} on {device}")
+    return SentenceTransformer(model_name, device=device)
+
 class MemoryManager:
     def __init__(self, api_url: str = "http://localhost:11434"):
         # Remove /api/generate from the URL if it's present
         self.api_url = api_url.replace("/api/generate", "")
         self.embedding_model = "nomic-embed-text:latest"
         self.fallback_model = "nomic-embed-text:latest"  # Smaller model as fallback
+        # LRU cache of recent embeddings keyed by SHA-256 of the text
+        self._emb_cache: OrderedDict[bytes, tuple[List[float], float]] = OrderedDict()
+        self._emb_cache_lock = asyncio.Lock()
+        # Background writer for queued memories
+        self.memory_queue: asyncio.Queue = asyncio.Queue()
+        self._drain_task: Optional[asyncio.Task] = None
+        self.st_model = None
+        if EMBEDDING_BACKEND == "sentence-transformers":
+            if SentenceTransformer is None:
+                logger.warning("sentence-transformers is not installed, using Ollama embeddings")
+            else:
+                try:
+                    self.st_model = _load_local_model(LOCAL_EMBEDDING_MODEL)
+                except Exception as e:
+                    logger.warning(f"Failed to load local embedding model, using Ollama embeddings: {e}")
         try:
-            self.client = chromadb.Client()
-            # Try to get existing collection or create new one
-            try:
-                self.collection = self.client.get_collection("chat_memories")
-            except ValueError:
-                self.collection = self.client.create_collection(
-                    name="chat_memories",
-                    metadata={"hnsw:space": "cosine"}
-                )
+            if CHROMA_HOST:
+                self.client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+            else:
+                self.client = chromadb.PersistentClient(path=CHROMA_PATH)
+            # Per-conversation collections, created on first use
+            self._collections: Dict[str, Any] = {}
+            # Entry counts by (collection name, type); the lock keeps an add and its count update together
+            self._type_counts: TTLCache = TTLCache(maxsize=MEMORY_COUNT_CACHE_SIZE, ttl=MEMORY_COUNT_CACHE_TTL)
+            self._type_counts_lock = threading.Lock()
         except Exception as e:
             logger.error(f"Error initializing ChromaDB: {e}")
             raise
 
+    def get_collection(self, conversation_id: str):
+        """Get or create the collection holding one conversation's memories."""
+        collection = self._collections.get(conversation_id)
+        if collection is None:
+            # Hash the ID so any conversation ID maps to a valid collection name
+            digest = hashlib.blake2b(conversation_id.encode(), digest_size=16).hexdigest()
+            collection = self.client.get_or_create_collection(
+                name=f"{COLLECTION_PREFIX}{digest}",
+                metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:M": HNSW_M,
+                    "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+                    "hnsw:search_ef": HNSW_SEARCH_EF
+                }
+            )
+            self._collections[conversation_id] = collection
+        return collection
+
+    def list_collections(self, conversation_id: Optional[str] = None) -> List[Any]:
+        """List memory collections, or only the one for the given conversation."""
+        if conversation_id:
+            return [self.get_collection(conversation_id)]
+        collections = []
+        for collection in self.client.list_collections():
+            name = getattr(collection, "name", collection)
+            if name.startswith(COLLECTION_PREFIX):
+                collections.append(self.client.get_collection(name) if isinstance(collection, str) else collection)
+        return collections
+
+    def count_memories(self, collection, type: Optional[str] = None) -> int:
+        """Count a collection's entries, optionally only those of one type (blocking)."""
+        if type is None:
+            return collection.count()
+        key = (collection.name, type)
+        with self._type_counts_lock:
+            count = self._type_counts.get(key)
+            if count is None:
+                # Chroma cannot count with a filter, so this fetches the matching ids once
+                count = self._type_counts[key] = len(collection.get(where={"type": type}, include=[])['ids'])
+            return count
+
+    def _add_to_collection(self, collection, batch: Dict[str, list]):
+        """Add a batch of entries and bump the cached per-type counts to match (blocking)."""
+        with self._type_counts_lock:
+            collection.add(**batch)
+            for metadata in batch["metadatas"]:
+                key = (collection.name, metadata["type"])
+                if key in self._type_counts:
+                    self._type_counts[key] += 1
+
+    async def close(self):
+        """Flush queued memories and stop the background writer."""
+        if self._drain_task is not None and not self._drain_task.done():
+            await self.memory_queue.join()
+            self._drain_task.cancel()
+
+    async def _get_cached_embedding(self, key: bytes) -> Optional[List[float]]:
+        """Return a cached embedding if present and not expired."""
+        async with self._emb_cache_lock:
+            cached = self._emb_cache.get(key)
+            if cached is None:
+                return None
+            embedding, expires_at = cached
+            if expires_at <= time.monotonic():
+                del self._emb_cache[key]
+                return None
+            self._emb_cache.move_to_end(key)
+            return embedding
+
+    async def _cache_embedding(self, key: bytes, embedding: List[float]):
+        """Cache an embedding, evicting the least recently used entry."""
+        if not embedding:
+            return
+        async with self._emb_cache_lock:
+            self._emb_cache[key] = (embedding, time.monotonic() + EMBEDDING_CACHE_TTL)
+            self._emb_cache.move_to_end(key)
+            if len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+
     async def get_embedding(self, text: str) -> List[float]:
-        try:
-            # First try with the main model
+        """Return the embedding for text, serving repeats from the cache."""
+        key = hashlib.sha256(text.encode()).digest()
+        embedding = await self._get_cached_embedding(key)
+        if embedding is None:
+            embedding = await self._fetch_embedding(text)
+            await self._cache_embedding(key, embedding)
+        return embedding
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Return embeddings for several texts, encoding cache misses in one batch when local."""
+        if self.st_model is None:
+            return list(await asyncio.gather(*(self.get_embedding(text) for text in texts)))
+
+        keys = [hashlib.sha256(text.encode()).digest() for text in texts]
+        embeddings = [await self._get_cached_embedding(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = await self._encode_local([texts[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                await self._cache_embedding(keys[i], embedding)
+        return embeddings
+
+    async def _encode_local(self, texts: List[str]) -> List[List[float]]:
+        """Encode texts with the local model in a worker thread."""
+        vectors = await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(self.st_model.encode, texts, batch_size=32, normalize_embeddings=True)
+        )
+        return vectors.tolist()
+
+    async def _fetch_embedding(self, text: str) -> List[float]:
+        if self.st_model is not None:
+            return (await self._encode_local([text]))[0]
+        return await self._fetch_ollama_embedding(text)
+
+    async def _fetch_ollama_embedding(self, text: str) -> List[float]:
+        session = await get_session()
+
+        async def _post(model: str) -> Optional[List[float]]:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{self.api_url}/api/embeddings",
-                        json={
-                            "model": self.embedding_model,
-                            "prompt": text
-                        }
-                    ) as response:
-                        if response.status == 200:
-                            result = await response.json()
-                            return result.get("embedding", [])
-                        elif response.status == 500 and "memory" in str(await response.text()).lower():
-                            # If memory error, try fallback model
-                            logger.info("Memory error, trying fallback model...")
-                            async with session.post(
-                                f"{self.api_url}/api/embed",
-                                json={
-                                    "model": self.fallback_model,
-                                    "prompt": text
-                                }
-                            ) as fallback_response:
-                                if fallback_response.status == 200:
-                                    result = await fallback_response.json()
-                                    return result.get("embedding", [])
-                        raise Exception(f"Failed to get embedding: {response.status}")
-            except Exception as e:
-                logger.error(f"Error with main model: {e}")
-                # Try fallback model
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{self.api_url}/api/embed",
-                        json={
-                            "model": self.fallback_model,
-                            "input": text
-                        }
-                    ) as fallback_response:
-                        if fallback_response.status == 200:
-                            result = await fallback_response.json()
-                            return result.get("embedding", [])
-                        raise Exception(f"Failed to get embedding with fallback: {fallback_response.status}")
-        except Exception as e:
-            logger.error(f"Error getting embedding: {e}")
-            raise
+                async with session.post(
+                    f"{self.api_url}/api/embeddings",
+                    json={
+                        "model": model,
+                        "prompt": text
+                    }
+                ) as response:
+                    if response.status != 200:
+                        logger.warning(f"Embedding request for {model} failed: {response.status}")
+                        return None
+                    result = await response.json(loads=orjson.loads)
+                    return result.get("embedding") or None
+            except aiohttp.ClientError as e:
+                logger.warning(f"Embedding request for {model} failed: {e}")
+                return None
 
-    async def store_memory(self, conversation_id: str, user_message: str, bot_message: str, 
-                          documents: List[str] = None, links: List[str] = None) -> Dict[str, Any]:
-        try:
-            # Create memory entry
-            memory_entry = {
-                "userMessage": user_message,
-                "botMessage": bot_message,
-                "documents": documents or [],
-                "links": links or [],
-                "timestamp": datetime.utcnow().isoformat(),
-                "conversationId": conversation_id
-            }
-
-            # Generate embeddings for all text content
-            texts_to_embed = [user_message, bot_message]
-            document_contents = []
-            link_contents = []
-
-            # Read document contents
-            if documents:
-                for doc_name in documents:
-                    try:
-                        with open(os.path.join('documents', doc_name), 'r') as f:
-                            content = f.read()
-                            document_contents.append(content)
-                            texts_to_embed.append(content)
-                    except Exception as e:
-                        logger.error(f"Error reading document {doc_name}: {e}")
-                        raise
-
-            # Read link contents
-            if links:
-                for link_name in links:
-                    try:
-                        with open(os.path.join('links', link_name), 'r') as f:
-                            link_data = json.load(f)
-                            content = link_data.get('content', '')
-                            link_contents.append(content)
-                            texts_to_embed.append(content)
-                    except Exception as e:
-                        logger.error(f"Error reading link {link_name}: {e}")
-                        raise
-
-            # Store each piece of text with its embedding in ChromaDB
-            for i, text in enumerate(texts_to_embed):
+        # Try the main model first, then the fallback on the same session
+        embedding = await _post(self.embedding_model) or await _post(self.fallback_model)
+        if embedding is None:
+            logger.error("Error getting embedding: main and fallback models both failed")
+            raise Exception("Failed to get embedding with fallback")
+        return embedding
+
+    def _prepare_memory(self, conversation_id: str, user_message: str, bot_message: str,
+                        documents: List[str] = None, links: List[str] = None) -> Dict[str, Any]:
+        """Build the memory entry and the texts to embed for one exchange."""
+        # One clock read serves both the entry timestamp and the stored IDs
+        timestamp_ns = time.time_ns()
+
+        # Create memory entry
+        memory_entry = {
+            "userMessage": user_message,
+            "botMessage": bot_message,
+            "documents": documents or [],
+            "links": links or [],
+            "timestamp": datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc).isoformat(),
+            "conversationId": conversation_id
+        }
+
+        # Collect all text content to embed
+        texts_to_embed = [user_message, bot_message]
+        types = ["user_message", "bot_message"]
+
+        # Read document contents
+        if documents:
+            for doc_name in documents:
+                try:
+                    with open(os.path.join('documents', doc_name), 'r') as f:
+                        texts_to_embed.append(f.read())
+                        types.append("document")
+                except Exception as e:
+                    logger.error(f"Error reading document {doc_name}: {e}")
+                    raise
+
+        # Read link contents
+        if links:
+            for link_name in links:
                 try:
-                    embedding = await self.get_embedding(text)
-                    self.collection.add(
-                        embeddings=[embedding],
-                        documents=[text],
-                        metadatas=[{
-                            "conversation_id": conversation_id,
-                            "timestamp": memory_entry["timestamp"],
-                            "type": "user_message" if i == 0 else "bot_message" if i == 1 else "document" if i < len(documents) + 2 else "link"
-                        }],
-                        ids=[f"{conversation_id}_{i}_{datetime.utcnow().timestamp()}"]
-                    )
+                    with open(os.path.join('links', link_name), 'rb') as f:
+                        link_data = orjson.loads(f.read())
+                        texts_to_embed.append(link_data.get('content', ''))
+                        types.append("link")
                 except Exception as e:
-                    logger.error(f"Error storing memory {i}: {e}")
+                    logger.error(f"Error reading link {link_name}: {e}")
                     raise
 
-            return memory_entry
+        return {
+            "entry": memory_entry,
+            "texts": texts_to_embed,
+            "types": types,
+            # Vectors already computed by the caller, aligned with texts
+            "embeddings": [None] * len(texts_to_embed),
+            "timestamp_ns": timestamp_ns
+        }
+
+    async def _add_memories(self, pending: List[Dict[str, Any]]):
+        """Embed prepared memories in one batch and store them with one add per conversation."""
+        # Only embed texts the caller did not already provide a vector for
+        missing = [
+            (item["embeddings"], i, text)
+            for item in pending
+            for i, text in enumerate(item["texts"])
+            if item["embeddings"][i] is None
+        ]
+        if missing:
+            computed = await self.get_embeddings([text for _, _, text in missing])
+            for (known, i, _), embedding in zip(missing, computed):
+                known[i] = embedding
+
+        batches: Dict[str, Dict[str, list]] = {}
+        for item in pending:
+            conversation_id = item["entry"]["conversationId"]
+            batch = batches.setdefault(
+                conversation_id, {"embeddings": [], "documents": [], "metadatas": [], "ids": []}
+            )
+            for i, (text, memory_type) in enumerate(zip(item["texts"], item["types"])):
+                batch["embeddings"].append(item["embeddings"][i])
+                batch["documents"].append(text)
+                batch["metadatas"].append({
+                    "conversation_id": conversation_id,
+                    "timestamp": item["entry"]["timestamp"],
+                    "type": memory_type,
+                    "preview": text[:MEMORY_PREVIEW_CHARS],
+                    "length": len(text)
+                })
+                batch["ids"].append(f"{conversation_id}_{i}_{item['timestamp_ns']}")
+
+        # Chroma writes to SQLite and the HNSW index synchronously, so keep them off the event loop
+        for conversation_id, batch in batches.items():
+            collection = await asyncio.to_thread(self.get_collection, conversation_id)
+            await asyncio.to_thread(self._add_to_collection, collection, batch)
+
+    async def store_memory(self, conversation_id: str, user_message: str, bot_message: str, 
+                          documents: List[str] = None, links: List[str] = None) -> Dict[str, Any]:
+        """Embed and store a memory before returning."""
+        try:
+            pending = self._prepare_memory(conversation_id, user_message, bot_message, documents, links)
+            await self._add_memories([pending])
+            return pending["entry"]
         except Exception as e:
             logger.error(f"Error in store_memory: {e}")
             raise
 
-    async def retrieve_relevant_memories(self, conversation_id: str, query: str, 
+    async def enqueue_memory(self, conversation_id: str, user_message: str, bot_message: str,
+                             documents: List[str] = None, links: List[str] = None,
+                             user_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Queue a memory to be embedded and stored by the background writer.
+
+        Pass user_embedding when the user message was already embedded so it is not embedded again.
+        """
+        try:
+            pending = self._prepare_memory(conversation_id, user_message, bot_message, documents, links)
+            if user_embedding:
+                pending["embeddings"][0] = user_embedding
+        except Exception as e:
+            logger.error(f"Error in enqueue_memory: {e}")
+            raise
+
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.create_task(self._drain_loop())
+        await self.memory_queue.put(pending)
+        return pending["entry"]
+
+    async def _drain_loop(self):
+        """Flush queued memories every batch interval or once the batch is full."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.memory_queue.get()]
+            deadline = loop.time() + MEMORY_BATCH_INTERVAL
+            while len(batch) < MEMORY_MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.memory_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._add_memories(batch)
+            except Exception as e:
+                logger.error(f"Error storing {len(batch)} queued memories: {e}")
+            finally:
+                for _ in batch:
+                    self.memory_queue.task_done()
+
+    async def retrieve_relevant_memories(self, conversation_id: str, query: Optional[str] = None,
+                                       query_embedding: Optional[List[float]] = None,
                                        limit: int = 5) -> List[Dict[str, Any]]:
         try:
-            # Get query embedding
-            query_embedding = await self.get_embedding(query)
+            # Embed the query unless the caller already has its vector
+            if query_embedding is None:
+                query_embedding = await self.get_embedding(query)
 
-            # Query ChromaDB for similar memories
-            results = self.collection.query(
+            # Query the conversation's own collection, so no metadata filter is needed
+            collection = await asyncio.to_thread(self.get_collection, conversation_id)
+            count = await asyncio.to_thread(collection.count)
+            if not count:
+                return []
+            results = await asyncio.to_thread(
+                collection.query,
                 query_embeddings=[query_embedding],
-                n_results=limit,
-                where={"conversation_id": conversation_id}
+                n_results=min(limit * MMR_FETCH_FACTOR, count),
+                include=["embeddings", "documents", "metadatas"]
             )
 
+            # Re-rank the candidates to drop near-duplicate memories
+            candidates = results['embeddings'][0]
+            selected = _mmr_select(query_embedding, candidates, limit) if len(candidates) else []
+
             # Format results into memory entries
             memories = []
-            for i in range(len(results['documents'][0])):
+            for i in selected:
                 memory = {
                     "text": results['documents'][0][i],
                     "timestamp": results['metadatas'][0][i]["timestamp"],
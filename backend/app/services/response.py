@@ -1,14 +1,66 @@
+import asyncio
+import hashlib
 import logging
+import re
+from collections import Counter
 from typing import Any, AsyncGenerator, Dict, List, Optional
 
+from cachetools import LRUCache
+
 from .llm_integration import LLMIntegration, ModelType
 
 logger = logging.getLogger(__name__)
 
+# Prompt templates, filled in with str.format. Document and link content goes first so
+# repeat questions about the same source share a prompt prefix the model can reuse
+DOCUMENT_PROMPT = "Document Content:\n{doc_content}"
+LINK_PROMPT = "Link Content:\n{link_content}"
+CONTEXT_PROMPT = "{input_text}\n\nRelevant Context:\n{context}"
+MEMORY_PROMPT = "Memory ({type}):\n{text}"
+WEB_SEARCH_PROMPT = "{input_text}\n\nWeb Search Results:\n{search_context}"
+SEARCH_RESULT_PROMPT = "Search Result {index}:\nTitle: {title}\nURL: {link}\nSnippet: {snippet}"
+SUMMARY_PROMPT = "Summarize the following text, keeping key facts, names and figures:\n\n{chunk}"
+
+# Content longer than this is summarized chunk by chunk before it goes into a prompt
+MAX_CONTENT_CHARS = 16_384
+SUMMARY_CHUNK_CHARS = 8_192
+# Content beyond this is first narrowed to the chunks most relevant to the question, which
+# bounds the summarization pass at MAX_SOURCE_CHARS / SUMMARY_CHUNK_CHARS model calls
+MAX_SOURCE_CHARS = 131_072
+_WORD_RE = re.compile(r"\w{3,}")
+# Summaries of oversized content are kept so repeat questions skip the map-reduce pass
+CONDENSED_CACHE_SIZE = 64
+
+def select_relevant_chunks(query: str, content: str, budget: int = MAX_SOURCE_CHARS) -> str:
+    """Keep the chunks of content sharing the most words with the query, up to budget characters.
+
+    Chunks are scored by how often the query's words occur in them and returned in
+    their original order.
+    """
+    if len(content) <= budget:
+        return content
+    terms = set(_WORD_RE.findall(query.lower()))
+    chunks = [
+        content[start:start + SUMMARY_CHUNK_CHARS]
+        for start in range(0, len(content), SUMMARY_CHUNK_CHARS)
+    ]
+    scores = []
+    for index, chunk in enumerate(chunks):
+        counts = Counter(_WORD_RE.findall(chunk.lower()))
+        scores.append((sum(counts[term] for term in terms), -index))
+    keep = sorted(-index for _, index in sorted(scores, reverse=True)[:max(budget // SUMMARY_CHUNK_CHARS, 1)])
+    return "".join(chunks[index] for index in keep)
+
 class ResponseGenerator:
     def __init__(self, llm_integration: LLMIntegration):
         self.llm_integration = llm_integration
         self.logger = logging.getLogger(__name__)
+        self._condensed: LRUCache = LRUCache(maxsize=CONDENSED_CACHE_SIZE)
+        # Model-specific generators by reasoning mode, bound once rather than chosen per call
+        self._generators = {
+            False: self.generate_simple_response,
+            True: self.generate_reasoned_response
+        }
 
     async def generate_simple_response(
         self,
@@ -46,57 +98,35 @@ class ResponseGenerator:
             self.logger.error(f"Error generating reasoned response: {e}")
             raise
 
-    async def generate_document_response(
+    async def generate_response(
         self,
         input_text: str,
-        doc_content: str,
         conversation_id: Optional[str] = None,
         stream: bool = False,
         is_reasoning_mode: bool = False
     ) -> str | AsyncGenerator[str, None]:
-        """Generate a response based on document content."""
-        try:
-            combined_input = f"{input_text}\n\nDocument Content:\n{doc_content}"
-            if is_reasoning_mode:
-                return await self.generate_reasoned_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
-            return await self.generate_simple_response(
-                combined_input,
-                conversation_id=conversation_id,
-                stream=stream
-            )
-        except Exception as e:
-            self.logger.error(f"Error generating document response: {e}")
-            raise
+        """Generate a response with the reasoned or simple model depending on the mode."""
+        generate = self._generators[bool(is_reasoning_mode)]
+        return await generate(input_text, conversation_id=conversation_id, stream=stream)
 
-    async def generate_link_response(
-        self,
-        input_text: str,
-        link_content: str,
-        conversation_id: Optional[str] = None,
-        stream: bool = False,
-        is_reasoning_mode: bool = False
-    ) -> str | AsyncGenerator[str, None]:
-        """Generate a response based on link content."""
-        try:
-            combined_input = f"{input_text}\n\nLink Content:\n{link_content}"
-            if is_reasoning_mode:
-                return await self.generate_reasoned_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
-            return await self.generate_simple_response(
-                combined_input,
-                conversation_id=conversation_id,
-                stream=stream
-            )
-        except Exception as e:
-            self.logger.error(f"Error generating link response: {e}")
-            raise
+    async def condense_content(self, content: str) -> str:
+        """Map-reduce summarize content that is too long to send to the model as-is."""
+        if len(content) <= MAX_CONTENT_CHARS:
+            return content
+        key = hashlib.blake2b(content.encode(), digest_size=16).digest()
+        condensed = self._condensed.get(key)
+        if condensed is not None:
+            return condensed
+        chunks = [
+            content[start:start + SUMMARY_CHUNK_CHARS]
+            for start in range(0, len(content), SUMMARY_CHUNK_CHARS)
+        ]
+        summaries = await asyncio.gather(*(
+            self.generate_simple_response(SUMMARY_PROMPT.format(chunk=chunk))
+            for chunk in chunks
+        ))
+        condensed = self._condensed[key] = "\n\n".join(summaries)
+        return condensed
 
     async def generate_combined_response(
         self,
@@ -109,24 +139,22 @@ class ResponseGenerator:
     ) -> str | AsyncGenerator[str, None]:
         """Generate a response combining document and link content."""
         try:
+            doc_content, link_content = await asyncio.gather(
+                self.condense_content(select_relevant_chunks(input_text, doc_content or "")),
+                self.condense_content(select_relevant_chunks(input_text, link_content or ""))
+            )
             context_parts = []
             if doc_content:
-                context_parts.append(f"Document Content:\n{doc_content}")
+                context_parts.append(DOCUMENT_PROMPT.format(doc_content=doc_content))
             if link_content:
-                context_parts.append(f"Link Content:\n{link_content}")
-            
-            combined_input = f"{input_text}\n\n" + "\n\n".join(context_parts)
-            
-            if is_reasoning_mode:
-                return await self.generate_reasoned_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
-            return await self.generate_simple_response(
+                context_parts.append(LINK_PROMPT.format(link_content=link_content))
+            context_parts.append(input_text)
+            combined_input = "\n\n".join(context_parts)
+            return await self.generate_response(
                 combined_input,
                 conversation_id=conversation_id,
-                stream=stream
+                stream=stream,
+                is_reasoning_mode=is_reasoning_mode
             )
         except Exception as e:
             self.logger.error(f"Error generating combined response: {e}")
@@ -144,22 +172,17 @@ class ResponseGenerator:
         try:
             # Format memories into context
             memory_context = "\n\n".join([
-                f"Memory ({mem['type']}):\n{mem['text']}"
+                MEMORY_PROMPT.format(type=mem['type'], text=mem['text'])
                 for mem in memories
             ])
             
-            combined_input = f"{input_text}\n\nRelevant Context:\n{memory_context}"
+            combined_input = CONTEXT_PROMPT.format(input_text=input_text, context=memory_context)
             
-            if is_reasoning_mode:
-                return await self.generate_reasoned_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
-            return await self.generate_simple_response(
+            return await self.generate_response(
                 combined_input,
                 conversation_id=conversation_id,
-                stream=stream
+                stream=stream,
+                is_reasoning_mode=is_reasoning_mode
             )
         except Exception as e:
             self.logger.error(f"Error generating contextual response: {e}")
@@ -180,24 +203,20 @@ class ResponseGenerator:
             
             # Format search results into context
             search_context = "\n\n".join([
-                f"Search Result {i+1}:\nTitle: {result['title']}\nURL: {result['link']}\nSnippet: {result['snippet']}"
+                SEARCH_RESULT_PROMPT.format(
+                    index=i + 1, title=result['title'], link=result['link'], snippet=result['snippet']
+                )
                 for i, result in enumerate(search_results)
             ])
             
-            combined_input = f"{input_text}\n\nWeb Search Results:\n{search_context}"
+            combined_input = WEB_SEARCH_PROMPT.format(input_text=input_text, search_context=search_context)
             
-            if is_reasoning_mode:
-                response = await self.generate_reasoned_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
-            else:
-                response = await self.generate_simple_response(
-                    combined_input,
-                    conversation_id=conversation_id,
-                    stream=stream
-                )
+            response = await self.generate_response(
+                combined_input,
+                conversation_id=conversation_id,
+                stream=stream,
+                is_reasoning_mode=is_reasoning_mode
+            )
             
             # Return both the response and search results
             return {
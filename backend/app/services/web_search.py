@@ -1,13 +1,16 @@
-import json
 import logging
 from typing import Dict, List, Optional
 from urllib.parse import quote_plus
 
-import aiohttp
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from .http_session import get_session
 
 logger = logging.getLogger(__name__)
 
+# Only the tags read by _extract_metadata need to be materialized
+METADATA_STRAINER = SoupStrainer(['meta', 'title', 'p', 'img'])
+
 class WebSearchService:
     def __init__(self, num_results: int = 5, lang: str = "en", timeout: int = 5):
         """Initialize the web search service.
@@ -52,53 +55,53 @@ class WebSearchService:
             }
             
             # Perform the search
-            async with aiohttp.ClientSession() as session:
-                async with session.get(search_url, headers=headers, timeout=self.timeout) as response:
-                    if response.status != 200:
-                        self.logger.error(f"Search request failed with status {response.status}")
-                        return []
-                    
-                    # Get the response content
-                    content = await response.text()
-                    self.logger.debug(f"Received response content: {content[:200]}...")
-                    
-                    # Parse HTML content
-                    soup = BeautifulSoup(content, 'html.parser')
-                    
-                    # Extract search results
-                    search_results = []
-                    
-                    # Find all result divs
-                    result_divs = soup.find_all('div', class_='result')
-                    
-                    for div in result_divs[:self.num_results]:
-                        try:
-                            # Extract title and link
-                            title_elem = div.find('a', class_='result__a')
-                            if not title_elem:
-                                continue
-                                
-                            title = title_elem.get_text(strip=True)
-                            link = title_elem.get('href', '')
-                            
-                            # Extract snippet
-                            snippet_elem = div.find('a', class_='result__snippet')
-                            snippet = snippet_elem.get_text(strip=True) if snippet_elem else ''
-                            
-                            # Add to results
-                            search_results.append({
-                                'title': title,
-                                'link': link,
-                                'snippet': snippet
-                            })
-                        except Exception as e:
-                            self.logger.error(f"Error parsing result: {e}")
+            session = await get_session()
+            async with session.get(search_url, headers=headers, timeout=self.timeout) as response:
+                if response.status != 200:
+                    self.logger.error(f"Search request failed with status {response.status}")
+                    return []
+                
+                # Get the response content
+                content = await response.text()
+                self.logger.debug(f"Received response content: {content[:200]}...")
+                
+                # Parse HTML content
+                soup = BeautifulSoup(content, 'html.parser')
+                
+                # Extract search results
+                search_results = []
+                
+                # Find all result divs
+                result_divs = soup.find_all('div', class_='result')
+                
+                for div in result_divs[:self.num_results]:
+                    try:
+                        # Extract title and link
+                        title_elem = div.find('a', class_='result__a')
+                        if not title_elem:
                             continue
-                    
-                    self.logger.info(f"Returning {len(search_results)} search results")
-                    self.logger.info(f"Search results: {search_results}")
-                    return search_results
-                    
+                            
+                        title = title_elem.get_text(strip=True)
+                        link = title_elem.get('href', '')
+                        
+                        # Extract snippet
+                        snippet_elem = div.find('a', class_='result__snippet')
+                        snippet = snippet_elem.get_text(strip=True) if snippet_elem else ''
+                        
+                        # Add to results
+                        search_results.append({
+                            'title': title,
+                            'link': link,
+                            'snippet': snippet
+                        })
+                    except Exception as e:
+                        self.logger.error(f"Error parsing result: {e}")
+                        continue
+                
+                self.logger.info(f"Returning {len(search_results)} search results")
+                self.logger.info(f"Search results: {search_results}")
+                return search_results
+                
         except Exception as e:
             self.logger.error(f"Error performing web search: {e}")
             return []
@@ -113,69 +116,69 @@ class WebSearchService:
             Dictionary containing extracted metadata
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as response:
-                    if response.status != 200:
-                        raise Exception(f"Failed to fetch URL: {response.status}")
-                    
-                    html = await response.text()
-                    soup = BeautifulSoup(html, 'html.parser')
-                    
-                    # Extract title
-                    title = None
-                    og_title = soup.find('meta', property='og:title')
-                    if og_title:
-                        title = og_title.get('content')
-                    if not title:
-                        title = soup.find('title')
-                        title = title.text if title else None
-                    if not title:
-                        title = url
-                    
-                    # Extract description
-                    description = None
-                    og_desc = soup.find('meta', property='og:description')
-                    if og_desc:
-                        description = og_desc.get('content')
-                    if not description:
-                        meta_desc = soup.find('meta', attrs={'name': 'description'})
-                        description = meta_desc.get('content') if meta_desc else None
-                    
-                    # Extract snippet (first paragraph or meta description)
-                    snippet = None
-                    if description:
-                        snippet = description
-                    else:
-                        first_para = soup.find('p')
-                        if first_para:
-                            snippet = first_para.text.strip()
-                    
-                    # Extract image
-                    image = None
-                    og_image = soup.find('meta', property='og:image')
-                    if og_image:
-                        image = og_image.get('content')
-                    if not image:
-                        twitter_image = soup.find('meta', name='twitter:image')
-                        if twitter_image:
-                            image = twitter_image.get('content')
-                    if not image:
-                        article_image = soup.find('img')
-                        if article_image:
-                            image = article_image.get('src')
-                    
-                    # Make image URL absolute if it's relative
-                    if image and not image.startswith(('http://', 'https://')):
-                        from urllib.parse import urljoin
-                        image = urljoin(url, image)
-                    
-                    return {
-                        'title': title,
-                        'description': description,
-                        'snippet': snippet,
-                        'image': image
-                    }
-                    
+            session = await get_session()
+            async with session.get(url, timeout=10) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to fetch URL: {response.status}")
+                
+                html = await response.text()
+                soup = BeautifulSoup(html, 'lxml', parse_only=METADATA_STRAINER)
+                
+                # Extract title
+                title = None
+                og_title = soup.find('meta', property='og:title')
+                if og_title:
+                    title = og_title.get('content')
+                if not title:
+                    title = soup.find('title')
+                    title = title.text if title else None
+                if not title:
+                    title = url
+                
+                # Extract description
+                description = None
+                og_desc = soup.find('meta', property='og:description')
+                if og_desc:
+                    description = og_desc.get('content')
+                if not description:
+                    meta_desc = soup.find('meta', attrs={'name': 'description'})
+                    description = meta_desc.get('content') if meta_desc else None
+                
+                # Extract snippet (first paragraph or meta description)
+                snippet = None
+                if description:
+                    snippet = description
+                else:
+                    first_para = soup.find('p')
+                    if first_para:
+                        snippet = first_para.text.strip()
+                
+                # Extract image
+                image = None
+                og_image = soup.find('meta', property='og:image')
+                if og_image:
+                    image = og_image.get('content')
+                if not image:
+                    twitter_image = soup.find('meta', name='twitter:image')
+                    if twitter_image:
+                        image = twitter_image.get('content')
+                if not image:
+                    article_image = soup.find('img')
+                    if article_image:
+                        image = article_image.get('src')
+                
+                # Make image URL absolute if it's relative
+                if image and not image.startswith(('http://', 'https://')):
+                    from urllib.parse import urljoin
+                    image = urljoin(url, image)
+                
+                return {
+                    'title': title,
+                    'description': description,
+                    'snippet': snippet,
+                    'image': image
+                }
+                
         except Exception as e:
             self.logger.error(f"Error extracting metadata from {url}: {e}")
             return {
@@ -6,6 +6,8 @@ import pytest
 
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# main.py is run as a script and imports its siblings (event_loop, services, ...) by top-level name
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'app')))
 
 @pytest.fixture(autouse=True)
 def setup_test_directories():
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.content_store import ContentStore
+
+
+@pytest.fixture
+def store(tmp_path) -> ContentStore:
+    """Create a content store backed by a temporary database."""
+    content_store = ContentStore(str(tmp_path / "content.sqlite3"), "documents")
+    yield content_store
+    content_store.close()
+
+def test_store_round_trip(store: ContentStore) -> None:
+    """Test that stored values are read back from disk."""
+    store["doc.txt"] = "Document text"
+    store["link"] = {"url": "https://example.com", "content": "Page text"}
+
+    assert "doc.txt" in store
+    assert store["doc.txt"] == "Document text"
+    assert store["link"]["url"] == "https://example.com"
+    assert len(store) == 2
+    assert sorted(store) == ["doc.txt", "link"]
+
+def test_store_delete(store: ContentStore) -> None:
+    """Test that deleted entries are gone and missing names raise KeyError."""
+    store["doc.txt"] = "Document text"
+    del store["doc.txt"]
+
+    assert "doc.txt" not in store
+    with pytest.raises(KeyError):
+        store["doc.txt"]
+    with pytest.raises(KeyError):
+        del store["doc.txt"]
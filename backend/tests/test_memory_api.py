@@ -3,7 +3,7 @@ import json
 import os
 import sys
 from datetime import datetime
-from typing import Any, AsyncGenerator, Dict
+from typing import Any, AsyncGenerator, Dict, Generator
 from unittest.mock import MagicMock, patch
 
 import aiohttp
@@ -14,9 +14,9 @@ from fastapi.testclient import TestClient
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.services.memory import MemoryManager
-
-from backend.app.main import app
+# Import through the same module names main.py uses so patches reach the app's objects
+from main import app
+from services.memory import MemoryManager
 
 # Test configuration
 TEST_CONVERSATION_ID = "test_conversation_123"
@@ -26,9 +26,10 @@ TEST_EMBEDDING = [0.1] * 768  # Mock embedding vector
 CHROMA_COLLECTION_NAME = "test_chat_memories"  # Use a consistent collection name
 
 @pytest.fixture(scope="session")
-def test_client() -> TestClient:
-    """Create a test client for the FastAPI app."""
-    return TestClient(app)
+def test_client() -> Generator[TestClient, None, None]:
+    """Create a test client for the FastAPI app, running its lifespan."""
+    with TestClient(app) as client:
+        yield client
 
 @pytest.fixture(scope="session")
 def chroma_client() -> chromadb.Client:
@@ -69,7 +70,7 @@ async def setup_and_cleanup(chroma_client: chromadb.Client) -> AsyncGenerator[No
         chroma_client.create_collection(CHROMA_COLLECTION_NAME)
     
     # Mock the ChromaDB client creation in MemoryManager
-    with patch('app.services.memory.chromadb.Client') as mock_client:
+    with patch('services.memory.chromadb.PersistentClient') as mock_client:
         mock_client.return_value = chroma_client
         yield
     
@@ -82,14 +83,14 @@ async def setup_and_cleanup(chroma_client: chromadb.Client) -> AsyncGenerator[No
 @pytest.fixture
 def mock_embedding():
     """Mock the embedding service to return a test embedding."""
-    with patch('app.services.memory.MemoryManager.get_embedding') as mock:
+    with patch('services.memory.MemoryManager.get_embedding') as mock:
         mock.return_value = TEST_EMBEDDING
         yield mock
 
 @pytest.fixture
 def mock_embedding_unavailable():
     """Mock the embedding service to simulate it being unavailable."""
-    with patch('app.services.memory.MemoryManager.get_embedding') as mock:
+    with patch('services.memory.MemoryManager.get_embedding') as mock:
         mock.side_effect = aiohttp.ClientError("Embedding service unavailable")
         yield mock
 
@@ -113,12 +114,12 @@ async def test_store_memory_with_real_embedding(test_client: TestClient) -> None
     }
     
     response = test_client.post('/store_memory', json=test_data)
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = response.json()
     
     assert "message" in data
     assert "memory" in data
-    assert data["message"] == "Memory stored successfully"
+    assert data["message"] == "Memory queued for storage"
     
     # Verify memory structure
     memory = data["memory"]
@@ -146,12 +147,12 @@ async def test_store_memory_success(test_client: TestClient, mock_embedding: Mag
     }
     
     response = test_client.post('/store_memory', json=test_data)
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = response.json()
     
     assert "message" in data
     assert "memory" in data
-    assert data["message"] == "Memory stored successfully"
+    assert data["message"] == "Memory queued for storage"
     
     # Verify memory structure
     memory = data["memory"]
@@ -168,24 +169,21 @@ async def test_store_memory_success(test_client: TestClient, mock_embedding: Mag
     assert memory["botMessage"] == "Test bot response"
     assert memory["documents"] == [TEST_DOCUMENT_NAME]
     assert memory["links"] == [TEST_LINK_NAME]
-    
-    # Verify embedding was called
-    mock_embedding.assert_called()
 
 @pytest.mark.asyncio
 async def test_store_memory_embedding_unavailable(test_client: TestClient, mock_embedding_unavailable: MagicMock) -> None:
-    """Test memory storage when embedding service is unavailable."""
+    """Test that memories are still accepted when the embedding service is unavailable."""
     test_data = {
         "conversationId": TEST_CONVERSATION_ID,
         "userMessage": {"text": "Test message"},
         "botMessage": {"text": "Test response"}
     }
     
+    # Embedding happens in the background writer, so the request is accepted
     response = test_client.post('/store_memory', json=test_data)
-    assert response.status_code == 503  # Service Unavailable
+    assert response.status_code == 202
     data = response.json()
-    assert "detail" in data
-    assert "Embedding service unavailable" in data["detail"]
+    assert data["memory"]["conversationId"] == TEST_CONVERSATION_ID
 
 @pytest.mark.asyncio
 async def test_store_memory_minimal_data(test_client: TestClient, mock_embedding: MagicMock) -> None:
@@ -197,15 +195,12 @@ async def test_store_memory_minimal_data(test_client: TestClient, mock_embedding
     }
     
     response = test_client.post('/store_memory', json=test_data)
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = response.json()
     
     assert "message" in data
     assert "memory" in data
-    assert data["message"] == "Memory stored successfully"
-    
-    # Verify embedding was called
-    mock_embedding.assert_called()
+    assert data["message"] == "Memory queued for storage"
 
 @pytest.mark.asyncio
 async def test_store_memory_no_messages(test_client: TestClient) -> None:
@@ -258,4 +253,48 @@ async def test_store_memory_malformed_json(test_client: TestClient) -> None:
     response = test_client.post('/store_memory', data="invalid json")
     assert response.status_code == 422  # FastAPI validation error
     data = response.json()
-    assert "detail" in data 
\ No newline at end of file
+    assert "detail" in data 
+
+@pytest.mark.asyncio
+async def test_get_embedding_uses_cache() -> None:
+    """Test that repeated texts are embedded only once."""
+    memory_manager = MemoryManager()
+    with patch.object(MemoryManager, '_fetch_embedding', return_value=TEST_EMBEDDING) as mock_fetch:
+        first = await memory_manager.get_embedding("Repeated question")
+        second = await memory_manager.get_embedding("Repeated question")
+
+    assert first == TEST_EMBEDDING
+    assert second == TEST_EMBEDDING
+    mock_fetch.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_enqueued_memories_are_flushed() -> None:
+    """Test that queued memories are embedded and stored by the background writer."""
+    memory_manager = MemoryManager()
+    collection = MagicMock()
+    with patch.object(MemoryManager, 'get_embeddings', return_value=[TEST_EMBEDDING] * 2) as mock_embeddings, \
+         patch.object(MemoryManager, 'get_collection', return_value=collection) as mock_collection:
+        memory = await memory_manager.enqueue_memory(TEST_CONVERSATION_ID, "Queued message", "Queued response")
+        await memory_manager.memory_queue.join()
+
+    assert memory["conversationId"] == TEST_CONVERSATION_ID
+    mock_embeddings.assert_called_once_with(["Queued message", "Queued response"])
+    mock_collection.assert_called_with(TEST_CONVERSATION_ID)
+    collection.add.assert_called_once()
+    await memory_manager.close()
+
+@pytest.mark.asyncio
+async def test_retrieve_with_precomputed_embedding_skips_embedding() -> None:
+    """Test that a caller-provided query embedding is used without embedding again."""
+    memory_manager = MemoryManager()
+    collection = MagicMock()
+    collection.count.return_value = 0
+    with patch.object(MemoryManager, 'get_embedding') as mock_embedding, \
+         patch.object(MemoryManager, 'get_collection', return_value=collection):
+        memories = await memory_manager.retrieve_relevant_memories(
+            TEST_CONVERSATION_ID, query_embedding=TEST_EMBEDDING
+        )
+
+    assert memories == []
+    mock_embedding.assert_not_called()
+    await memory_manager.close()
@@ -3,7 +3,7 @@ import { useState, useRef, useEffect } from "react";
 import ChatMessage from "./ChatMessage";
 import UserInput from "./UserInput";
 import { Message } from "@/types";
-import { sendMessage, uploadDocument, crawlLink } from "@/utils/api";
+import { sendMessage, uploadDocument, waitForDocument, crawlLink } from "@/utils/api";
 import { toast } from "@/hooks/use-toast";
 import { v4 as uuidv4 } from 'uuid';
 
@@ -88,7 +88,8 @@ const ChatInterface = () => {
     setIsLoading(true);
 
     try {
-      const response = await uploadDocument(file);
+      await uploadDocument(file);
+      await waitForDocument(file.name);
       
       const assistantMessage: Message = {
         id: uuidv4(),
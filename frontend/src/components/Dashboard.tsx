@@ -93,10 +93,9 @@ export default function Dashboard({ documents, links }: DashboardProps) {
     
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
-      setAnalyticsData(prevData => ({
-        ...prevData,
-        ...data
-      }));
+      // The server coalesces messages queued close together into a single batch frame
+      const messages = data.type === 'batch' ? data.events : [data];
+      setAnalyticsData(prevData => Object.assign({}, prevData, ...messages));
       setLoading(false);
     };
 
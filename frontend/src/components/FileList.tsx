@@ -4,6 +4,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/u
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { Eye, FileText, Trash2 } from "lucide-react";
 import { useState } from "react";
+import { getDocumentContent } from "../utils/api";
 
 interface File {
   id: string;
@@ -21,6 +22,20 @@ interface FileListProps {
 
 export function FileList({ documents, onDelete, onSelect }: FileListProps) {
   const [previewFile, setPreviewFile] = useState<File | null>(null);
+  const [previewContent, setPreviewContent] = useState("");
+
+  // The document listing leaves content out, so it is fetched when a preview opens
+  const openPreview = async (file: File) => {
+    setPreviewFile(file);
+    setPreviewContent(file.content);
+    if (!file.content) {
+      try {
+        setPreviewContent(await getDocumentContent(file.id));
+      } catch (error) {
+        console.error('Error loading document content:', error);
+      }
+    }
+  };
 
   return (
     <div className="flex flex-col h-full">
@@ -48,7 +63,7 @@ export function FileList({ documents, onDelete, onSelect }: FileListProps) {
                   variant="ghost"
                   size="icon"
                   className="h-8 w-8"
-                  onClick={() => setPreviewFile(file)}
+                  onClick={() => openPreview(file)}
                 >
                   <Eye className="h-4 w-4" />
                 </Button>
@@ -74,7 +89,7 @@ export function FileList({ documents, onDelete, onSelect }: FileListProps) {
           <ScrollArea className="mt-4">
             <div className="p-4 bg-muted rounded-md">
               <pre className="whitespace-pre-wrap text-sm">
-                {previewFile?.content}
+                {previewContent}
               </pre>
             </div>
           </ScrollArea>
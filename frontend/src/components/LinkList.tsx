@@ -4,6 +4,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/u
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { Eye, Link as LinkIcon, Trash2 } from "lucide-react";
 import { useState } from "react";
+import { getLinkContent } from "../utils/api";
 
 interface Link {
   id: string;
@@ -22,6 +23,20 @@ interface LinkListProps {
 
 export function LinkList({ links, onDelete, onSelect }: LinkListProps) {
   const [previewLink, setPreviewLink] = useState<Link | null>(null);
+  const [previewContent, setPreviewContent] = useState("");
+
+  // The link listing leaves content out, so it is fetched when a preview opens
+  const openPreview = async (link: Link) => {
+    setPreviewLink(link);
+    setPreviewContent(link.content || "");
+    if (!link.content) {
+      try {
+        setPreviewContent(await getLinkContent(link.id));
+      } catch (error) {
+        console.error('Error loading link content:', error);
+      }
+    }
+  };
 
   return (
     <div className="flex flex-col h-full">
@@ -49,7 +64,7 @@ export function LinkList({ links, onDelete, onSelect }: LinkListProps) {
                   variant="ghost"
                   size="icon"
                   className="h-8 w-8"
-                  onClick={() => setPreviewLink(link)}
+                  onClick={() => openPreview(link)}
                 >
                   <Eye className="h-4 w-4" />
                 </Button>
@@ -77,9 +92,9 @@ export function LinkList({ links, onDelete, onSelect }: LinkListProps) {
               {previewLink?.description && (
                 <p className="text-sm mb-4">{previewLink.description}</p>
               )}
-              {previewLink?.content && (
+              {previewContent && (
                 <pre className="whitespace-pre-wrap text-sm">
-                  {previewLink.content}
+                  {previewContent}
                 </pre>
               )}
               <a 
@@ -2,6 +2,7 @@ import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from "@/components/ui/tooltip";
 import { Message } from "@/types";
+import { getDocumentContent, waitForDocument } from "@/utils/api";
 import { Globe, Lightbulb, Link, Search, Upload } from "lucide-react";
 import { useEffect, useRef, useState } from "react";
 import LinkInputDialog from "./LinkInputDialog";
@@ -141,6 +142,10 @@ export default function UserInput({
       const data = await response.json();
       console.log('Upload response:', data);
       
+      // The upload returns before extraction; wait for the text before using it
+      await waitForDocument(file.name);
+      const content = await getDocumentContent(file.name);
+      
       // Create a file message with metadata
       const fileMessage: Message = {
         id: generateUniqueId(),
@@ -151,7 +156,7 @@ export default function UserInput({
           fileName: file.name,
           fileType: file.type,
           fileSize: file.size,
-          content: data.content || '' // Use content from response if available
+          content
         },
         timestamp: new Date().toISOString()
       };
@@ -9,6 +9,15 @@ const handleResponse = async (response: Response) => {
   return response.json();
 };
 
+// Same as handleResponse, for endpoints that return plain text
+const handleTextResponse = async (response: Response) => {
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(errorText || 'API request failed');
+  }
+  return response.text();
+};
+
 // Memory API calls
 export const retrieveMemory = async (query: string) => {
   const response = await fetch(`${API_BASE_URL}/retrieve_memory`, {
@@ -80,6 +89,29 @@ export const getDocuments = async () => {
   return handleResponse(response);
 };
 
+// Uploads return before text extraction finishes; poll until the document is ready
+const DOCUMENT_STATUS_POLL_MS = 500;
+
+export const getDocumentStatus = async (id: string) => {
+  const response = await fetch(`${API_BASE_URL}/document_status/${encodeURIComponent(id)}`);
+  return handleResponse(response);
+};
+
+export const waitForDocument = async (id: string) => {
+  for (;;) {
+    const { status, detail } = await getDocumentStatus(id);
+    if (status === 'ready') return;
+    if (status === 'failed') throw new Error(detail || 'Document extraction failed');
+    await new Promise((resolve) => setTimeout(resolve, DOCUMENT_STATUS_POLL_MS));
+  }
+};
+
+// Listings leave content out; previews fetch it on demand
+export const getDocumentContent = async (id: string) => {
+  const response = await fetch(`${API_BASE_URL}/document_content/${encodeURIComponent(id)}`);
+  return handleTextResponse(response);
+};
+
 export const deleteDocument = async (id: string) => {
   const response = await fetch(`${API_BASE_URL}/document_delete`, {
     method: 'POST',
@@ -108,6 +140,11 @@ export const getLinks = async () => {
   return handleResponse(response);
 };
 
+export const getLinkContent = async (id: string) => {
+  const response = await fetch(`${API_BASE_URL}/link_content/${encodeURIComponent(id)}`);
+  return handleTextResponse(response);
+};
+
 export const deleteLink = async (id: string) => {
   const response = await fetch(`${API_BASE_URL}/link_delete`, {
     method: 'POST',